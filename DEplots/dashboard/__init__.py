@@ -1,12 +1,33 @@
 import yaml
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
 import pandas as pd
 from plotly import express as px
+from DEplots.dashboard.tablecache import read_table
+from DEplots.dashboard.lazy import LazyTable, TABLE_CACHE
+from DEplots.dashboard.figcache import FIGURE_CACHE
+from DEplots.dashboard.filtering import FILTER_ENGINE
+from DEplots.dashboard.shared import share_array, share_frame, shared_prefix
+from DEplots.dashboard.compact import compact_comparisons, report_compaction
+from DEplots.dashboard.store import build_store, build_projections
+from DEplots.dashboard.significance import SignificanceIndex
+from DEplots.enrichment import group_gsea_plot_data, prepare_enrichment_plot_data
 
 DIRPATH = os.path.dirname(os.path.abspath(__file__))
 
 
-def get_data(config_file: str = None, run_dir: str = None,):
+def get_data(
+        config_file: str = None,
+        run_dir: str = None,
+        load_workers: int = 1,
+        cache_dir: str = None,
+        shared_memory=None,
+        compact: bool = False,
+        compress: bool = None,
+        fast_json: bool = None
+):
     if config_file is None:
         config_file = os.path.join(DIRPATH, "default_config.yaml")
     with open(config_file, "r") as handle:
@@ -14,111 +35,320 @@ def get_data(config_file: str = None, run_dir: str = None,):
 
     if run_dir:
         config["run_dir"] = run_dir
-    return read_files(config), config
+    if cache_dir:
+        config["cache_dir"] = cache_dir
+    if shared_memory:
+        config["shared_memory"] = shared_memory
+    if compact:
+        config["compact"] = compact
+    if compress is not None:
+        config["compress"] = compress
+    if fast_json is not None:
+        config["fast_json"] = fast_json
+    return read_files(config, load_workers=load_workers), config
 
 
-def read_files(config):
+ENRICHMENT_TYPES = ["ClusteredGO", "GO", "KEGG"]
+
+
+def _read_yaml(file):
+    with open(file, "r") as handle:
+        return yaml.safe_load(handle)
+
+
+def _read_gsea(gsea_file, plot_data_file, read_tsv):
+    gsea = read_tsv(gsea_file)
+    plot_data, plot_groups = group_gsea_plot_data(read_tsv(plot_data_file))
+    return {
+        "plot_data": plot_data,
+        "plot_groups": plot_groups,
+        "df": gsea.drop("core_enrichment", axis=1),
+    }
+
+
+def parse_enrichment(df, genes):
+    """ Pre-parses the gene ID columns of a clusterProfiler table
+
+    The "/" separated geneID and universeGeneID strings are resolved to int32 row positions into genes once, so
+    that selecting a term does not need to split strings. IDs missing in genes get the position -1.
+
+    Args:
+        df (pd.DataFrame): enrichment table
+        genes (pd.Index): gene index of the comparison
+
+    Returns:
+        dict: the table under "df", its plot-ready form under "plot" (see prepare_enrichment_plot_data), a
+        Description -> row lookup under "terms" and for every gene ID column a tuple of row offsets and positions.
+        The positions of row i are positions[offsets[i]:offsets[i + 1]].
+
+    """
+    parsed = {"df": df, "plot": prepare_enrichment_plot_data(df), "terms": {}}
+    for row, description in enumerate(df["Description"]):
+        parsed["terms"].setdefault(description, row)
+    for col in ("geneID", "universeGeneID"):
+        if col in df.columns:
+            ids = [value.split("/") if isinstance(value, str) else [] for value in df[col]]
+            offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(row_ids) for row_ids in ids])
+            positions = genes.get_indexer_for([gene for row_ids in ids for gene in row_ids]).astype(np.int32)
+            parsed[col] = (offsets, positions)
+    return parsed
+
+
+def term_positions(parsed, row, col="geneID"):
+    """ Returns the sorted unique row positions of the genes of a term. Genes missing in the comparison are dropped."""
+    offsets, positions = parsed[col]
+    positions = np.unique(positions[offsets[row]:offsets[row + 1]])
+    return positions[positions >= 0]
+
+
+def link_enrichment(dash_data, stores):
+    """ Lets the enrichment tables of every run resolve their gene IDs against the gene index of its comparison"""
+    for entry in dash_data.values():
+        for comp, data in entry["comparisons"].items():
+            if comp not in stores:
+                continue
+            for handles in data["enrich"].values():
+                for handle in handles.values():
+                    if handle is not None:
+                        handle.prepare = partial(parse_enrichment, genes=stores[comp]["genes"])
+
+
+def _qc_files(dirname):
+    return {
+        "correlation": os.path.join(dirname, f"PipelineData/IntermediateData/CorrData.tsv"),
+        "pca": os.path.join(dirname, f"PipelineData/IntermediateData/PCAData.tsv"),
+    }
+
+
+def _comparison_files(dirname, condition, baseline):
+    files = {
+        "deseq": os.path.join(dirname, f"PipelineData/DESeqResults/DESeqResult_c{condition}_vs_b{baseline}.tsv"),
+        "gsea": os.path.join(dirname, f"PipelineData/Enrichment/GSEAGO_c{condition}_vs_b{baseline}.tsv"),
+        "gsea_plot_data": os.path.join(
+            dirname, f"PipelineData/Enrichment/GSEAGO_plot_data_c{condition}_vs_b{baseline}.tsv"
+        ),
+    }
+    for enrich in ENRICHMENT_TYPES:
+        for updown in ("up", "down"):
+            files[(enrich, updown)] = os.path.join(
+                dirname, f"PipelineData/Enrichment/{enrich}Enrichment_{updown}_c{condition}_vs_b{baseline}.tsv"
+            )
+    return files
+
+
+def get_config_files(config):
     if config["run_dir"]:
         runs = os.listdir(config["run_dir"])
         config_files = {run: os.path.join(config["run_dir"], run, "config.yml") for run in runs}
     else:
         assert config["config_files"], "No files specified for display"
         config_files = config["config_files"]
-    name_mapping = config["name_mapping"]
+    return config_files
+
+
+def comparison_names(condition, baseline, name_mapping):
+    if name_mapping:
+        cname = name_mapping[condition] if condition in name_mapping else condition
+        bname = name_mapping[baseline] if baseline in name_mapping else baseline
+    else:
+        cname = condition
+        bname = baseline
+    return cname, bname
+
+
+def read_files(config, load_workers: int = 1):
+    """ Reads all runs specified in the config into the structures used by the dashboard
+
+    Args:
+        config (dict): dashboard config containing either a run_dir or config_files. If it specifies a cache_dir, the
+            parsed tables are cached on disk and only files that changed since the last start are parsed again.
+            Enrichment and GSEA tables are stored as LazyTable handles that are read on first access. They are
+            kept in memory until the memory_budget (in MB) of the config is exceeded. If compact is set, the
+            comparison frames use float32 and categorical columns where possible (see compact_comparisons).
+            If shared_memory is set, the
+            numeric columns of the comparison frames are placed in memory mapped files (see share_frame) so that
+            worker processes share them instead of holding private copies. The files are named after the comparison
+            and the paths and modification times of its source files and removed when the process exits. The figures created by the callbacks are
+            cached as JSON until the figure_budget (in MB) is exceeded. If it is False, figures are not cached.
+            Filter masks and sort orders of the tables are cached until the filter_budget (in MB) is exceeded.
+        load_workers (int): Number of threads used to read the config and table files in parallel. The returned
+            data does not depend on this number.
+
+    Returns:
+        List[dict, dict, dict]: the per run data, a MultiIndex DataFrame per comparison and a store per comparison
+        holding a dense genes x datasets array per statistic (see build_store) and the significance bitsets of its
+        datasets under the "significance" key if its runs configure cutoffs (see SignificanceIndex) and the single dataset views of the comparison
+        under the "projections" key (see build_projections)
+
+    """
+    config_files = get_config_files(config)
+    budget = config.get("memory_budget", False)
+    TABLE_CACHE.budget = int(budget * 2 ** 20) if budget else None
+    figure_budget = config.get("figure_budget", False)
+    FIGURE_CACHE.budget = int(figure_budget * 2 ** 20) if figure_budget else 0
+    FIGURE_CACHE.clear()
+    filter_budget = config.get("filter_budget", 64)
+    FILTER_ENGINE.budget = int(filter_budget * 2 ** 20) if filter_budget else 0
+    FILTER_ENGINE.clear()
+    with ThreadPoolExecutor(max_workers=max(load_workers, 1)) as pool:
+        add_data = pool.submit(read_add_data, config)
+        runs = read_runs(config, config_files, pool)
+        add_data = add_data.result()
+    dash_data = {name: entry for name, (entry, _) in runs.items()}
+    multiindex_data, stores = build_comparisons(runs, add_data, config)
+    link_enrichment(dash_data, stores)
+    # A list, so that reloads can replace all three items at once (see update_runs)
+    return [dash_data, multiindex_data, stores]
+
+
+def read_add_data(config):
     if config["add_data"]:
-        add_data = config["add_data"]
-        add_data = pd.read_csv(add_data, sep="\t", index_col=0)
+        add_data = read_table(config["add_data"], cache_dir=config.get("cache_dir", False), index_col=0)
         add_data.columns = add_data.columns.str.replace('_', ' ')
 
     else:
         add_data = None
+    return add_data
 
-    dash_data = {}
-    multiindex_data = {}
-    multiindex_count = {}
+
+def read_runs(config, config_files, pool):
+    """ Reads the runs in config_files using the thread pool
+
+    Returns:
+        dict: The dash_data entry and the DESeq result per comparison of every run
+
+    """
+    name_mapping = config["name_mapping"]
+    read_tsv = partial(read_table, cache_dir=config.get("cache_dir", False))
+    run_configs = dict(zip(config_files, pool.map(_read_yaml, config_files.values())))
+
+    # Schedule every existing table first so the reads overlap, then assemble the results in the same order as
+    # a sequential read would.
+    tables = {}
+    for name, file in config_files.items():
+        d = run_configs[name]
+        dirname = os.path.dirname(file)
+        paths = list(_qc_files(dirname).values())
+        for (condition, baseline) in zip(d["conditions"], d["baselines"]):
+            paths.append(_comparison_files(dirname, condition, baseline)["deseq"])
+        for path in paths:
+            if path not in tables and os.path.isfile(path):
+                tables[path] = pool.submit(read_tsv, path)
+
+    runs = {}
     for name, file in config_files.items():
-        with open(file, "r") as handle:
-            d = yaml.safe_load(handle)
-            dirname = os.path.dirname(file)
-            dash_data[name] = {
-                "comparisons": {},
-                "config": d,
-                "qc": {}
-            }
-            corr_file = os.path.join(dirname, f"PipelineData/IntermediateData/CorrData.tsv")
-            pca_file = os.path.join(dirname, f"PipelineData/IntermediateData/PCAData.tsv")
-            if os.path.exists(corr_file):
-                corr = pd.read_csv(corr_file, sep="\t")
-                dash_data[name]["qc"]["correlation"] = corr
-            else:
-                print(f"Correlation file {corr_file} was not found")
-            if os.path.exists(pca_file):
-                pca = pd.read_csv(pca_file, sep="\t")
-                dash_data[name]["qc"]["pca"] = pca
-            else:
-                print(f"PCA file {pca_file} was not found")
-
-
-            for (condition, baseline) in zip(d["conditions"], d["baselines"]):
-                comp_file = os.path.join(dirname, f"PipelineData/DESeqResults/DESeqResult_c{condition}_vs_b{baseline}.tsv")
-
-                assert os.path.isfile(comp_file), f"File {comp_file} not found"
-                df = pd.read_csv(comp_file, sep="\t")
-
-                if name_mapping:
-                    cname = name_mapping[condition] if condition in name_mapping else condition
-                    bname = name_mapping[baseline] if baseline in name_mapping else baseline
+        d = run_configs[name]
+        dirname = os.path.dirname(file)
+        entry = {
+            "comparisons": {},
+            "config": d,
+            "qc": {}
+        }
+        deseq = {}
+        runs[name] = (entry, deseq)
+        qc_files = _qc_files(dirname)
+        corr_file = qc_files["correlation"]
+        pca_file = qc_files["pca"]
+        if corr_file in tables:
+            corr = tables[corr_file].result()
+            entry["qc"]["correlation"] = corr
+        else:
+            print(f"Correlation file {corr_file} was not found")
+        if pca_file in tables:
+            pca = tables[pca_file].result()
+            entry["qc"]["pca"] = pca
+        else:
+            print(f"PCA file {pca_file} was not found")
+
+
+        for (condition, baseline) in zip(d["conditions"], d["baselines"]):
+            files = _comparison_files(dirname, condition, baseline)
+            comp_file = files["deseq"]
+
+            assert comp_file in tables, f"File {comp_file} not found"
+            cname, bname = comparison_names(condition, baseline, name_mapping)
+            comp_str = f"{cname} vs {bname}"
+            deseq[comp_str] = tables[comp_file].result()
+            entry["comparisons"][comp_str] = {}
+            entry["comparisons"][comp_str]["deseq"] = None
+            entry["comparisons"][comp_str]["deseq_file"] = comp_file
+            entry["comparisons"][comp_str]["enrich"] = {}
+            entry["comparisons"][comp_str]["condition"] = cname
+            entry["comparisons"][comp_str]["baseline"] = bname
+
+            for enrich in ENRICHMENT_TYPES:
+                enrich_file_up = files[(enrich, "up")]
+                enrich_file_down = files[(enrich, "down")]
+                entry["comparisons"][comp_str]["enrich"][enrich] = {}
+                if os.path.isfile(enrich_file_up):
+                    enrich_up = LazyTable(partial(read_tsv, enrich_file_up))
                 else:
-                    cname = condition
-                    bname = baseline
-                comp_str = f"{cname} vs {bname}"
-                dash_data[name]["comparisons"][comp_str] = {}
-                if comp_str not in multiindex_data:
-                    multiindex_data[comp_str] = [[], []]
-                    multiindex_count[comp_str] = 0
-                multiindex_data[comp_str][0] = multiindex_data[comp_str][0] + [(name, col) for col in df.columns]
-                multiindex_data[comp_str][1].append(df)
-                old = multiindex_count[comp_str]
-                multiindex_count[comp_str] = old + df.shape[1]
-                dash_data[name]["comparisons"][comp_str]["deseq"] = (old, multiindex_count[comp_str])
-                dash_data[name]["comparisons"][comp_str]["enrich"] = {}
-                dash_data[name]["comparisons"][comp_str]["condition"] = cname
-                dash_data[name]["comparisons"][comp_str]["baseline"] = bname
-
-                for enrich in ["ClusteredGO", "GO", "KEGG"]:
-                    enrich_file_up = os.path.join(dirname,
-                                                  f"PipelineData/Enrichment/{enrich}Enrichment_up_c{condition}_vs_b{baseline}.tsv")
-                    enrich_file_down = os.path.join(dirname,
-                                                    f"PipelineData/Enrichment/{enrich}Enrichment_down_c{condition}_vs_b{baseline}.tsv")
-                    dash_data[name]["comparisons"][comp_str]["enrich"][enrich] = {}
-                    if os.path.isfile(enrich_file_up):
-                        enrich_up = pd.read_csv(enrich_file_up, sep="\t")
-                    else:
-                        enrich_up = None
-                        print(f"File {enrich_file_up} not found")
-                    if os.path.isfile(enrich_file_down):
-                        enrich_down = pd.read_csv(enrich_file_down, sep="\t")
-                    else:
-                        enrich_down = None
-                        print(f"File {enrich_file_down} not found")
-                    dash_data[name]["comparisons"][comp_str]["enrich"][enrich][cname] = enrich_up
-                    dash_data[name]["comparisons"][comp_str]["enrich"][enrich][bname] = enrich_down
-
-                gsea_file = os.path.join(
-                    dirname,
-                    f"PipelineData/Enrichment/GSEAGO_c{condition}_vs_b{baseline}.tsv"
-                )
-                gsea_plot_data = os.path.join(
-                    dirname,
-                    f"PipelineData/Enrichment/GSEAGO_plot_data_c{condition}_vs_b{baseline}.tsv"
+                    enrich_up = None
+                    print(f"File {enrich_file_up} not found")
+                if os.path.isfile(enrich_file_down):
+                    enrich_down = LazyTable(partial(read_tsv, enrich_file_down))
+                else:
+                    enrich_down = None
+                    print(f"File {enrich_file_down} not found")
+                entry["comparisons"][comp_str]["enrich"][enrich][cname] = enrich_up
+                entry["comparisons"][comp_str]["enrich"][enrich][bname] = enrich_down
+
+            gsea_file = files["gsea"]
+            gsea_plot_data = files["gsea_plot_data"]
+            if os.path.isfile(gsea_file) and os.path.isfile(gsea_plot_data):
+                entry["comparisons"][comp_str]["gsea"] = LazyTable(
+                    partial(_read_gsea, gsea_file, gsea_plot_data, read_tsv)
                 )
-                if os.path.isfile(gsea_file) and os.path.isfile(gsea_plot_data):
-                    gsea_plot_data = pd.read_csv(gsea_plot_data, sep="\t")
-                    gsea_file = pd.read_csv(gsea_file, sep="\t")
-                    gsea_file = gsea_file.drop("core_enrichment", axis=1)
-                    dash_data[name]["comparisons"][comp_str]["gsea"] = {}
-                    dash_data[name]["comparisons"][comp_str]["gsea"]["plot_data"] = gsea_plot_data
-                    dash_data[name]["comparisons"][comp_str]["gsea"]["df"] = gsea_file
+    return runs
+
+
+def read_deseq(config, file, run_config, comps):
+    """ Reads the DESeq results of a single run for the comparisons in comps"""
+    dirname = os.path.dirname(file)
+    deseq = {}
+    for (condition, baseline) in zip(run_config["conditions"], run_config["baselines"]):
+        cname, bname = comparison_names(condition, baseline, config["name_mapping"])
+        comp_str = f"{cname} vs {bname}"
+        if comp_str in comps:
+            comp_file = _comparison_files(dirname, condition, baseline)["deseq"]
+            deseq[comp_str] = read_table(comp_file, cache_dir=config.get("cache_dir", False))
+    return deseq
+
+
+def build_comparisons(runs, add_data, config):
+    """ Joins the DESeq results of all runs into one MultiIndex DataFrame per comparison
+
+    Args:
+        runs (dict): The dash_data entry and the DESeq result per comparison of every run as returned by read_runs.
+            The column range of each run in the joined frame is stored in the deseq field of its entry.
+        add_data (pd.DataFrame): Additional data appended to every comparison.
+        config (dict): dashboard config
+
+    Returns:
+        Tuple[dict, dict]: a MultiIndex DataFrame and a store per comparison
+
+    """
+    multiindex_data = {}
+    multiindex_count = {}
+    cutoffs = {}
+    sources = {}
+    for name, (entry, deseq) in runs.items():
+        for comp_str, df in deseq.items():
+            if comp_str not in multiindex_data:
+                multiindex_data[comp_str] = [[], []]
+                multiindex_count[comp_str] = 0
+                cutoffs[comp_str] = set()
+                sources[comp_str] = [config["add_data"]] if config["add_data"] else []
+            sources[comp_str].append(entry["comparisons"][comp_str]["deseq_file"])
+            padj_cutoff, lfc_cutoff = entry["config"].get("pAdjCutOff"), entry["config"].get("log2FCCutOff")
+            if padj_cutoff is not None and lfc_cutoff is not None:
+                cutoffs[comp_str].add((padj_cutoff, lfc_cutoff))
+            multiindex_data[comp_str][0] = multiindex_data[comp_str][0] + [(name, col) for col in df.columns]
+            multiindex_data[comp_str][1].append(df)
+            old = multiindex_count[comp_str]
+            multiindex_count[comp_str] = old + df.shape[1]
+            entry["comparisons"][comp_str]["deseq"] = (old, multiindex_count[comp_str])
 
     for key, value in multiindex_data.items():
         names, dfs = value
@@ -134,7 +364,28 @@ def read_files(config):
         cols = [("Name", "Name")] + [col for col in df.columns if col != ("Name", "Name")]
         df = df[cols]
         multiindex_data[key] = df
-    return dash_data, multiindex_data
+    if config.get("compact", False):
+        before = {key: df.memory_usage(deep=True).sum() for key, df in multiindex_data.items()}
+        multiindex_data = compact_comparisons(multiindex_data)
+    stores = {}
+    for key, df in multiindex_data.items():
+        if config.get("shared_memory", False):
+            prefix = shared_prefix(config["shared_memory"], key, sources[key])
+            df, stores[key] = build_store(
+                df, allocate=lambda array, statistic: share_array(array, file=f"{prefix}_store_{statistic}.npy")
+            )
+            df = share_frame(df, prefix, shared=stores[key]["arrays"].values())
+            stores[key]["shared_prefix"] = prefix
+        else:
+            df, stores[key] = build_store(df)
+        if config.get("compact", False):
+            report_compaction(key, before[key], df, stores[key])
+        if cutoffs[key]:
+            # Without configured cutoffs there is nothing to precompute. The callbacks then compute the masks on use.
+            stores[key]["significance"] = SignificanceIndex(stores[key], cutoffs[key])
+        stores[key]["projections"] = build_projections(df, stores[key])
+        multiindex_data[key] = df
+    return multiindex_data, stores
 
 
 DEFAULT_PLOTLY_COLORS = {
@@ -175,4 +426,18 @@ COVERAGE_DESIGN = None
 GFF = None
 LINE_MAPPING = None
 GFF_ATTRIBUTES = None
-CONFIG = None
\ No newline at end of file
+CONFIG = None
+
+
+def loaded_data():
+    """ Returns the dash data, the comparison frames and the stores of the loaded version of the data
+
+    Reloads replace all three items of DASH_DATA at once (see update_runs). Callbacks call this once and only use
+    the returned items, so that a reload while they run does not mix items of two versions.
+
+    Returns:
+        Tuple[dict, dict, dict]: the items of DASH_DATA
+
+    """
+    dash_data, multiindex_data, stores = DASH_DATA
+    return dash_data, multiindex_data, stores
@@ -4,6 +4,7 @@ import dash
 from dash import Dash, html, dcc, clientside_callback, Input, Output, State, ALL, ClientsideFunction
 import dash_bootstrap_components as dbc
 import DEplots.dashboard
+from DEplots.dashboard.transport import set_json_engine, enable_compression
 
 FILEDIR = os.path.dirname(os.path.abspath(__file__))
 ASSETS_DIR = os.path.join(FILEDIR, "assets")
@@ -21,6 +22,9 @@ app = Dash(
     prevent_initial_callbacks='initial_duplicate',
     use_pages=True
 )
+set_json_engine(CONFIG.get("fast_json", False))
+if CONFIG.get("compress", False):
+    enable_compression(app.server, level=CONFIG.get("compress_level", 4))
 print("APP defined")
 
 
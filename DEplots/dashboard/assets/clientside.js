@@ -46,6 +46,37 @@ window.dash_clientside = Object.assign({}, window.dash_clientside, {
         //
         //
         // },
+        apply_theme: function (switchOn, figure) {
+            // Sets the values of the light (switchOn) or dark theme stored in layout.meta.theme_values by the server.
+            // Only the containers along the changed paths are copied, the data arrays are shared with the old figure.
+            if (!figure || !figure.layout || !figure.layout.meta || !figure.layout.meta.theme_values) {
+                return window.dash_clientside.no_update
+            }
+            const position = switchOn ? 1 : 2;
+            figure = Object.assign({}, figure);
+            const copies = new Set([figure]);
+            for (const entry of figure.layout.meta.theme_values) {
+                const path = entry[0];
+                const value = entry[position];
+                let target = figure;
+                for (let i = 0; i < path.length - 1; i++) {
+                    let child = target[path[i]];
+                    if (!copies.has(child)) {
+                        child = Array.isArray(child) ? child.slice() : Object.assign({}, child);
+                        copies.add(child);
+                        target[path[i]] = child;
+                    }
+                    target = child;
+                }
+                const key = path[path.length - 1];
+                if (value === null && !Array.isArray(target)) {
+                    delete target[key];
+                } else {
+                    target[key] = value;
+                }
+            }
+            return figure
+        },
         update_trace_color: function(color, trace_colors, trace){
             console.log(trace_colors)
             trace_colors[trace] = color
@@ -8,9 +8,21 @@ def cli_wrapper(
         debug: bool = False,
         port: int = 8080,
         host: str = "127.0.0.1",
-        processes: int = 1
+        processes: int = 1,
+        load_workers: int = 1,
+        cache_dir: str = None,
+        shared_memory=None,
+        watch: float = None,
+        compact: bool = False,
+        compress: bool = None,
+        fast_json: bool = None,
 ):
-    DEplots.dashboard.DASH_DATA, DEplots.dashboard.CONFIG = get_data(config_file, run_dir)
+    DEplots.dashboard.DASH_DATA, DEplots.dashboard.CONFIG = get_data(
+        config_file, run_dir, load_workers, cache_dir, shared_memory, compact, compress, fast_json
+    )
+    if watch:
+        from DEplots.dashboard.reload import watch_runs
+        watch_runs(DEplots.dashboard.DASH_DATA, DEplots.dashboard.CONFIG, watch, load_workers)
     from DEplots.dashboard.app import app, get_layout
 
     app.layout = get_layout()
@@ -19,7 +31,8 @@ def cli_wrapper(
 
 def _cli_wrapper(args):
     print(args)
-    cli_wrapper(args.config, args.run_dir, args.debug, args.port, args.host, args.processes)
+    cli_wrapper(args.config, args.run_dir, args.debug, args.port, args.host, args.processes, args.load_workers,
+                args.cache_dir, args.shared_memory, args.watch, args.compact, args.compress, args.fast_json)
 
 
 
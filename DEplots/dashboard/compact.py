@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_float_dtype, is_object_dtype, is_string_dtype
+
+FLOAT32_INFO = np.finfo(np.float32)
+
+
+def _fits_float32(values: np.ndarray):
+    # Values outside the normal float32 range would overflow, underflow to zero or lose precision as subnormals.
+    # Everything else is stored with a relative error below 6e-8.
+    finite = np.abs(values[np.isfinite(values) & (values != 0)])
+    return finite.size == 0 or (finite.min() >= FLOAT32_INFO.tiny and finite.max() <= FLOAT32_INFO.max)
+
+
+def compact_frame(df: pd.DataFrame, category_ratio: float = 0.5):
+    """ Returns a copy of df that uses less memory
+
+    float64 columns are downcast to float32 if all values lie within the normal float32 range. This usually keeps the
+    adjusted p-values of highly significant genes in float64. String columns whose number of unique values is at most
+    category_ratio times the number of rows are converted to categoricals.
+
+    Args:
+        df (pd.DataFrame): DataFrame to compact
+        category_ratio (float): maximum ratio of unique values to rows for categorical conversion
+
+    Returns:
+        pd.DataFrame: the compacted DataFrame
+
+    """
+    columns = {}
+    for i, (column, dtype) in enumerate(df.dtypes.items()):
+        series = df.iloc[:, i]
+        if dtype == np.float64 and _fits_float32(series.to_numpy()):
+            series = series.astype(np.float32)
+        elif (is_object_dtype(dtype) or (is_string_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype))) \
+                and series.nunique() <= category_ratio * len(series):
+            series = series.astype("category")
+        columns[i] = series
+    compact = pd.DataFrame(columns, index=df.index)
+    compact.columns = df.columns
+    return compact
+
+
+def compact_comparisons(multiindex_data: dict):
+    """ Compacts the MultiIndex frame of every comparison
+
+    Comparisons sharing the same genes additionally share one gene index object instead of holding a copy each. The
+    saved memory is reported via report_compaction once the store of a comparison is built.
+
+    Args:
+        multiindex_data (dict): a MultiIndex DataFrame per comparison as returned by build_comparisons
+
+    Returns:
+        dict: the compacted DataFrames using the same keys
+
+    """
+    indices = []
+    compacted = {}
+    for key, df in multiindex_data.items():
+        df = compact_frame(df)
+        for index in indices:
+            if index.equals(df.index):
+                df.index = index
+                break
+        else:
+            indices.append(df.index)
+        compacted[key] = df
+    return compacted
+
+
+def report_compaction(key, before: int, df: pd.DataFrame, store: dict):
+    """ Prints the memory of a comparison before and after compacting it
+
+    Args:
+        key (str): The comparison.
+        before (int): Memory of the comparison frame in bytes before compact_comparisons.
+        df (pd.DataFrame): The compacted frame as returned by build_store.
+        store (dict): The store of the comparison. Frame columns that are views into its arrays are counted once.
+
+    """
+    arrays = list(store["arrays"].values())
+    after = df.index.memory_usage(deep=True) + sum(array.nbytes for array in arrays)
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i]
+        if not any(np.may_share_memory(values.to_numpy(), array) for array in arrays):
+            after += values.memory_usage(deep=True, index=False)
+    print(f"Compacted {key}: {before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB "
+          f"(saved {(before - after) / 2 ** 20:.1f} MB)")
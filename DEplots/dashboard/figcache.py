@@ -0,0 +1,103 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import wraps
+from DEplots.dashboard.theme import themed_figure, apply_theme
+from DEplots.dashboard.transport import dumps, loads
+
+
+class FigureCache:
+    """ Keeps serialized figures in memory and evicts the least recently used ones once the budget is exceeded
+
+    Args:
+        budget (int): Memory budget in bytes. If None, nothing is evicted. If 0, nothing is cached.
+
+    """
+    def __init__(self, budget: int = None):
+        self.budget = budget
+        self.size = 0
+        # Incremented by clear, so that figures built from data older than the last clear are not stored
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget != 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def put(self, key, value: str, generation: int = None):
+        size = len(value)
+        if self.budget is not None and size > self.budget:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.size += size
+            while self.budget is not None and self.size > self.budget:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.generation += 1
+
+
+FIGURE_CACHE = FigureCache()
+
+
+def figure_key(name: str, args):
+    """ Key of a callback call. Inputs like highlight dicts are hashed via their JSON representation."""
+    return name, hashlib.sha1(json.dumps(args, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def cached_figure(name: str, cache: FigureCache = FIGURE_CACHE, themed: bool = False):
+    """ Decorator caching the figure JSON returned by a callback keyed by name and the callback inputs
+
+    The decorated function has to be deterministic in its inputs and the loaded data. The cache is cleared whenever
+    the data is read or reloaded. Figures whose build started before such a clear are returned but not stored.
+
+    Args:
+        name (str): Name distinguishing the callback from other cached callbacks.
+        cache (FigureCache): Cache holding the figures. Defaults to the FIGURE_CACHE shared by all callbacks.
+        themed (bool): If set, the last argument of the callback is the value of the mode-switch. It is not part of
+            the key, since the figure is built with the values of both themes via themed_figure and the requested
+            one is applied. The decorated function receives a Theme (see theme.py) in its place.
+
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            if themed:
+                *args, switch = args
+            if not cache.enabled:
+                # Nothing would be stored, so the figure is neither keyed nor serialized
+                return apply_theme(themed_figure(lambda theme: func(*args, theme)), switch) if themed else func(*args)
+            key = figure_key(name, args)
+            value = cache.get(key)
+            if value is None:
+                # Taken before the function reads the data via loaded_data (reloads swap the data before clearing)
+                generation = cache.generation
+                if themed:
+                    fig = themed_figure(lambda theme: func(*args, theme))
+                    cache.put(key, dumps(fig), generation)
+                    # Not shared with the cached JSON, so the theme can be applied in place
+                    return apply_theme(fig, switch)
+                value = dumps(func(*args))
+                cache.put(key, value, generation)
+            fig = loads(value)
+            return apply_theme(fig, switch) if themed else fig
+        return wrapper
+    return decorator
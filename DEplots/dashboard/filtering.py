@@ -0,0 +1,245 @@
+import threading
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+operators = [
+    ['contains '],
+    ['ge ', '>='],
+    ['le ', '<='],
+    ['lt ', '<'],
+    ['gt ', '>'],
+    ['ne ', '!='],
+    ['eq ', '='],
+    ['datestartswith ']
+]
+
+
+def split_filter_part(filter_part):
+    for operator_type in operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0]
+                if (v0 == value_part[-1] and v0 in ("'", '"', '`')):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # word operators need spaces after them in the filter string,
+                # but we don't want these later
+                return name, operator_type[0].strip(), value
+
+    return [None] * 3
+
+
+COMPARISONS = {
+    "eq": np.equal,
+    "ne": np.not_equal,
+    "lt": np.less,
+    "le": np.less_equal,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+}
+
+
+@lru_cache(maxsize=256)
+def compile_query(filter_query: str):
+    """ Parses a DataTable filter_query once into a tuple of (column id, operator, value) clauses"""
+    plan = []
+    for filter_part in filter_query.split(' && ') if filter_query else ():
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name is not None:
+            plan.append((col_name, operator, filter_value))
+    return tuple(plan)
+
+
+def _sort_spec(df: pd.DataFrame, sort_by, column=None):
+    spec = []
+    for col in sort_by or []:
+        if col["column_id"]:
+            name = column(col["column_id"]) if column is not None else col["column_id"]
+            if name in df.columns:
+                spec.append((name, col["direction"] == "asc"))
+    return tuple(spec)
+
+
+class FilterEngine:
+    """ Evaluates DataTable filter queries and sort orders and caches the results
+
+    Queries are compiled once via compile_query. Every clause is evaluated as one vectorized operation on the full
+    column and the clause masks are combined, so the table is never copied. Clause masks, combined masks and the
+    lowercased text of columns used in contains clauses are kept in an LRU cache per table key. Adding a clause to
+    a query thus only evaluates the new clause. Sort permutations of all rows are cached per sort_by and the sorted
+    positions of the selected rows per filter state, so paging only slices a cached array. Entries remember the
+    table they were computed from, so callbacks still working on a table that was replaced by a reload cannot serve
+    their results for the new one.
+
+    Args:
+        budget (int): Memory budget in bytes of the cached masks, permutations and text columns. If None, nothing is
+            evicted. If 0, nothing is cached.
+
+    """
+    def __init__(self, budget: int = 64 * 2 ** 20):
+        self.budget = budget
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, df: pd.DataFrame):
+        with self._lock:
+            if key in self._entries:
+                table, value = self._entries[key]
+                if table() is df:
+                    self._entries.move_to_end(key)
+                    return value
+        return None
+
+    def _put(self, key, df: pd.DataFrame, value: np.ndarray):
+        value.setflags(write=False)
+        size = value.nbytes
+        if self.budget is not None and size > self.budget:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1].nbytes
+            self._entries[key] = (weakref.ref(df), value)
+            self.size += size
+            while self.budget is not None and self.size > self.budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted.nbytes
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _text(self, key, df: pd.DataFrame, col):
+        text = self._get((key, "text", col), df)
+        if text is None:
+            values = df[col]
+            text = values.astype(str).str.lower().to_numpy(dtype=str)
+            # missing values never match, like in the DataTable
+            text = self._put((key, "text", col), df, np.where(values.isna().to_numpy(), "", text))
+        return text
+
+    def _clause(self, key, df: pd.DataFrame, clause, column=None):
+        mask = self._get((key, clause), df)
+        if mask is not None:
+            return mask
+        col_name, operator, filter_value = clause
+        col = column(col_name) if column is not None else col_name
+        values = df[col]
+        if operator in COMPARISONS:
+            if isinstance(values.dtype, np.dtype) and values.dtype.kind in "iuf" and isinstance(filter_value, float):
+                mask = COMPARISONS[operator](values.to_numpy(), filter_value)
+            else:
+                try:
+                    # these operators match pandas series operator method names
+                    mask = getattr(values, operator)(filter_value).to_numpy(dtype=bool)
+                except TypeError:
+                    # e.g. a text value compared to a numeric column
+                    mask = np.zeros(len(df), dtype=bool)
+        elif operator == 'contains':
+            text = self._text(key, df, col)
+            mask = np.char.find(text, str(filter_value).lower()) >= 0
+        elif operator == 'datestartswith':
+            # this is a simplification of the front-end filtering logic,
+            # only works with complete fields in standard format
+            mask = values.astype(str).str.startswith(str(filter_value)).to_numpy(dtype=bool)
+        else:
+            mask = np.ones(len(df), dtype=bool)
+        return self._put((key, clause), df, mask)
+
+    def mask(self, key, df: pd.DataFrame, filter_query: str, column=None):
+        """ Boolean mask of the rows of df matching all clauses of filter_query
+
+        Args:
+            key (Hashable): Identifies df, e.g. the comparison. Cached masks are only valid as long as the data
+                behind key does not change, see clear.
+            df (pd.DataFrame): The table.
+            filter_query (str): The filter_query of the DataTable.
+            column (callable): Maps the column ids of the DataTable to the columns of df. Defaults to the identity.
+
+        Returns:
+            np.ndarray: read-only boolean mask of the matching rows
+
+        """
+        plan = compile_query(filter_query or "")
+        if len(plan) == 1:
+            return self._clause(key, df, plan[0], column)
+        mask = self._get((key, plan), df)
+        if mask is None:
+            mask = np.ones(len(df), dtype=bool)
+            for clause in plan:
+                mask &= self._clause(key, df, clause, column)
+            mask = self._put((key, plan), df, mask)
+        return mask
+
+    def order(self, key, df: pd.DataFrame, sort_by, column=None):
+        """ Permutation of all rows of df sorting them by the sort_by of a DataTable
+
+        Missing values are sorted last and ties keep the row order. Sort columns that are not in df are ignored.
+
+        Args:
+            key (Hashable): Identifies df, see mask.
+            df (pd.DataFrame): The table.
+            sort_by (List[dict]): The sort_by of the DataTable.
+            column (callable): Maps the column ids of the DataTable to the columns of df. Defaults to the identity.
+
+        Returns:
+            np.ndarray: read-only row positions in sorted order or None if there is nothing to sort by
+
+        """
+        spec = _sort_spec(df, sort_by, column)
+        if not spec:
+            return None
+        order = self._get((key, "order", spec), df)
+        if order is None:
+            subset = pd.DataFrame({i: df[col].to_numpy() for i, (col, _) in enumerate(spec)})
+            order = subset.sort_values(
+                list(range(len(spec))), ascending=[ascending for _, ascending in spec], kind="stable"
+            ).index.to_numpy()
+            order = self._put((key, "order", spec), df, order)
+        return order
+
+    def rows(self, key, df: pd.DataFrame, mask: np.ndarray, sort_by, column=None, state=None):
+        """ Positions of the rows selected by mask in the order given by sort_by
+
+        The sort order of all rows is cached per sort_by (see order), so sorting the selected rows only takes one
+        pass over the cached permutation. Paging through the result is a slice.
+
+        Args:
+            key (Hashable): Identifies df, see mask.
+            df (pd.DataFrame): The table.
+            mask (np.ndarray): Boolean mask of the selected rows.
+            sort_by (List[dict]): The sort_by of the DataTable.
+            column (callable): Maps the column ids of the DataTable to the columns of df. Defaults to the identity.
+            state (Hashable): Describes how mask was created, e.g. the filter_query. If given, the result is cached.
+
+        Returns:
+            np.ndarray: read-only row positions
+
+        """
+        spec = _sort_spec(df, sort_by, column)
+        if state is not None:
+            rows = self._get((key, "rows", state, spec), df)
+            if rows is not None:
+                return rows
+        order = self.order(key, df, sort_by, column)
+        rows = np.flatnonzero(mask) if order is None else order[mask[order]]
+        if state is not None:
+            rows = self._put((key, "rows", state, spec), df, rows)
+        return rows
+
+
+FILTER_ENGINE = FilterEngine()
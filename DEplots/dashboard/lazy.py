@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+def nbytes(obj):
+    """ Estimates the memory in bytes used by a loaded table or a nested structure of tables and arrays"""
+    if obj is None:
+        return 0
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(nbytes(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(value) for value in obj)
+    return 0
+
+
+class LRUCache:
+    """ Keeps loaded tables in memory and evicts the least recently used ones once the budget is exceeded
+
+    Args:
+        budget (int): Memory budget in bytes. If None, nothing is evicted.
+
+    """
+    def __init__(self, budget: int = None):
+        self.budget = budget
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, handle: "LazyTable"):
+        with self._lock:
+            if handle in self._entries:
+                self._entries.move_to_end(handle)
+                return self._entries[handle][0]
+        value = handle.load()
+        size = nbytes(value)
+        with self._lock:
+            if handle not in self._entries:
+                self._entries[handle] = (value, size)
+                self.size += size
+            self._evict()
+        return value
+
+    def _evict(self):
+        while self.budget is not None and self.size > self.budget and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+TABLE_CACHE = LRUCache()
+
+
+class LazyTable:
+    """ Handle to data that is only read from disk on first access
+
+    Args:
+        loader (callable): Function without arguments that reads and returns the data.
+        cache (LRUCache): Cache holding the loaded data. Defaults to the TABLE_CACHE shared by all handles.
+        prepare (callable): Optional function applied to the data after reading, e.g. to precompute lookups that
+            depend on data that is not available when the handle is created. Can be set later.
+
+    """
+    def __init__(self, loader, cache: LRUCache = TABLE_CACHE, prepare=None):
+        self.loader = loader
+        self.cache = cache
+        self.prepare = prepare
+
+    def load(self):
+        value = self.loader()
+        return self.prepare(value) if self.prepare is not None else value
+
+    def get(self):
+        return self.cache.get(self)
@@ -2,45 +2,63 @@ from DEplots.diffexp import volcano_from_deseq_result, ma_from_deseq_result
 from DEplots.enrichment import enrichment_plot_from_cp_table, empty_figure, plot_gsea
 from DEplots.qc import pheatmap, sample_pca
 import dash
-from dash import callback, html, clientside_callback, Input, Output, dcc, dash_table, State, Patch
+from dash import callback, html, clientside_callback, Input, Output, dcc, dash_table, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 from dash.dash_table.Format import Format, Scheme
 from pandas.api.types import is_numeric_dtype
+from DEplots.dashboard.figcache import cached_figure
+from DEplots.dashboard.filtering import FILTER_ENGINE
+from DEplots.dashboard.store import DERIVED_COLUMNS
 from DEplots.dashboard import DEFAULT_PLOTLY_COLORS, DEFAULT_PLOTLY_COLORS_LIST, LAYOUT, DARK_LAYOUT, UP_COLOR_LIGHT, \
-    UP_COLOR_DARK, DOWN_COLOR_LIGHT, DOWN_COLOR_DARK, DASH_DATA
+    UP_COLOR_DARK, DOWN_COLOR_LIGHT, DOWN_COLOR_DARK, CONFIG, term_positions, loaded_data
 import pandas as pd
+import numpy as np
 
 dash.register_page(__name__, path='/analysis', name="Visualization")
 
 
-def get_deseq_result(dataset_key, comp):
-    df = DASH_DATA[1][comp]
-    idx = pd.IndexSlice
-    df1_columns = df.loc[:, idx[["Name",  dataset_key, "Additional Data"], :]]
-    df1_columns.columns = df1_columns.columns.droplevel(0)
-    if "Gene" in df1_columns.columns:
-        df1_columns = df1_columns[["Name", "Gene"] + [col for col in df1_columns.columns[1:] if col != "Gene"]]
-    return df1_columns
+def get_deseq_result(stores, dataset_key, comp):
+    # Built once at load time (see build_projections). It is shared by all callbacks and must not be modified.
+    return stores[comp]["projections"][dataset_key]
 
 
-def get_enrich_result(dataset_key, comp, enrich: str = "GO", updown: str = "up-regulated"):
-    df = DASH_DATA[0][dataset_key]["comparisons"][comp]["enrich"][enrich][updown]
+def current_highlight(stores, highlight_data, comp):
+    """ Returns highlight_data if its gene positions belong to the loaded genes of comp and an empty one otherwise
+
+    The positions refer to the rows of the comparison. They are tagged with the version of its genes, so a reload
+    that changes the genes drops them instead of highlighting other genes.
+    """
+    version = stores[comp]["version"]
+    if highlight_data and highlight_data.get("version") == version:
+        return highlight_data
+    return {"version": version}
+
+
+def get_enrich_result(dash_data, dataset_key, comp, enrich: str = "GO", updown: str = "up-regulated"):
+    parsed = get_parsed_enrich_result(dash_data, dataset_key, comp, enrich, updown)
+    df = parsed["df"] if parsed is not None else None
     return df
 
-def get_gsea_result(dataset_key, comp):
-    df = DASH_DATA[0][dataset_key]["comparisons"][comp]["gsea"]["df"]
-    plot_data = DASH_DATA[0][dataset_key]["comparisons"][comp]["gsea"]["plot_data"]
-    return df, plot_data
 
+def get_parsed_enrich_result(dash_data, dataset_key, comp, enrich: str = "GO", updown: str = "up-regulated"):
+    handle = dash_data[dataset_key]["comparisons"][comp]["enrich"][enrich][updown]
+    return handle.get() if handle is not None else None
 
+def get_gsea_result(dash_data, dataset_key, comp):
+    gsea = dash_data[dataset_key]["comparisons"][comp]["gsea"].get()
+    df = gsea["df"]
+    plot_data = gsea["plot_data"]
+    return df, plot_data, gsea["plot_groups"]
 
 
-def get_table(dash_data):
+
+
+def get_table(dash_data, stores):
     d = list(dash_data.keys())[0]
     data = dash_data[d]
     comp = list(data["comparisons"].keys())[0]
-    df = get_deseq_result(d, comp)
+    df = get_deseq_result(stores, d, comp)
 
     table = dbc.Card(
         [
@@ -66,9 +84,9 @@ def get_table(dash_data):
                             columns=None,
                             data=None,
                             editable=True,
-                            filter_action="native",
+                            filter_action="custom",
                             filter_options={"case": "insensitive"},
-                            sort_action="native",
+                            sort_action="custom",
                             sort_mode="multi",
                             column_selectable="single",
                             merge_duplicate_headers=True,
@@ -76,7 +94,7 @@ def get_table(dash_data):
                             row_deletable=False,
                             selected_columns=[],
                             selected_rows=[],
-                            page_action="native",
+                            page_action="custom",
                             page_current=0,
                             page_size=10,
                             style_as_list_view=True,
@@ -125,7 +143,7 @@ def get_gsea_table(dash_data):
     d = list(dash_data.keys())[0]
     data = dash_data[d]
     comp = list(data["comparisons"].keys())[0]
-    df, _ = get_gsea_result(d, comp)
+    df, _, _ = get_gsea_result(dash_data, d, comp)
     table = dbc.Card(
         [
             dbc.CardHeader(
@@ -324,7 +342,7 @@ def _get_qc_card():
     return div
 
 
-def get_layout(dash_data):
+def get_layout(dash_data, stores):
     enrich_keys = list(list(list(dash_data.values())[0]["comparisons"].values())[0]["enrich"].keys())
     layout = html.Div([
         dcc.Store(data={}, id="volcano-highlight-ids"),
@@ -471,7 +489,7 @@ def get_layout(dash_data):
                 dbc.Row(
                     [
                         dbc.Col(
-                            get_table(dash_data),
+                            get_table(dash_data, stores),
                             width=12,
                         ),
 
@@ -512,61 +530,71 @@ def get_layout(dash_data):
     return layout
 
 
-layout = get_layout(DASH_DATA[0])
+def layout(**kwargs):
+    # Created on every page load so that runs added by the run watcher show up
+    dash_data, _, stores = loaded_data()
+    return get_layout(dash_data, stores)
 
 
 
 @callback(
-    [Output('deseq-table', 'selected_rows')],
+    Output('deseq-table', 'selected_rows', allow_duplicate=True),
+    Output('volcano-highlight-ids', 'data', allow_duplicate=True),
     [
         Input('select-all', 'n_clicks'),
         Input('deselect-all', 'n_clicks')
     ],
     [
         State('deseq-table', 'data'),
-        State('deseq-table', 'derived_virtual_data'),
-        State('deseq-table', 'derived_virtual_selected_rows')
-    ]
+        State('deseq-table', 'filter_query'),
+        State('volcano-highlight-ids', 'data'),
+        State('dataset-dd', 'value'),
+        State('comparison-dd', 'value'),
+    ],
+    prevent_initial_call=True
 )
-def select_all(select_n_clicks, deselect_n_clicks, original_rows, filtered_rows, selected_rows):
+def select_all(select_n_clicks, deselect_n_clicks, page_rows, filter_query, highlight_data, dataset_key, comp):
+    # The table only holds the current page, so the selection of all filtered rows is computed on the server
     ctx = dash.callback_context.triggered[0]
     ctx_caller = ctx['prop_id']
-    if filtered_rows is not None:
-        if ctx_caller == 'select-all.n_clicks':
-            selected_ids = [row for row in filtered_rows]
-            return [[i for i, row in enumerate(original_rows) if row in selected_ids]]
-        if ctx_caller == 'deselect-all.n_clicks':
-            return [[]]
-        raise PreventUpdate
-    else:
+    if page_rows is None:
         raise PreventUpdate
+    _, _, stores = loaded_data()
+    highlight_data = current_highlight(stores, highlight_data, comp)
+    if ctx_caller == 'select-all.n_clicks':
+        df = get_deseq_result(stores, dataset_key, comp)
+        mask = FILTER_ENGINE.mask(("analysis", dataset_key, comp), df, filter_query)
+        highlight_data["Selected"] = np.flatnonzero(mask).tolist()
+        return list(range(len(page_rows))), highlight_data
+    if ctx_caller == 'deselect-all.n_clicks':
+        highlight_data["Selected"] = []
+        return [], highlight_data
+    raise PreventUpdate
 
 @callback(
     Output('gsea-graph', 'figure'),
     Input('gsea-table', 'selected_rows'),
-    Input('mode-switch', 'value'),
 
     State('dataset-dd', 'value'),
     State('comparison-dd', 'value'),
+    State('mode-switch', 'value'),
 )
-def get_gsea_plot(selected_rows, switch, dataset_key, comp):
-    df, plot_data = get_gsea_result(dataset_key, comp)
+@cached_figure("gsea", themed=True)
+def get_gsea_plot(selected_rows, dataset_key, comp, theme):
+    dash_data, _, _ = loaded_data()
+    df, plot_data, plot_groups = get_gsea_result(dash_data, dataset_key, comp)
     descs = df["Description"].iloc[selected_rows]
-    cond = DASH_DATA[0][dataset_key]["comparisons"][comp]["condition"]
-    baseline = DASH_DATA[0][dataset_key]["comparisons"][comp]["baseline"]
+    cond = dash_data[dataset_key]["comparisons"][comp]["condition"]
+    baseline = dash_data[dataset_key]["comparisons"][comp]["baseline"]
     if df is not None and len(df) > 0:
-        fig = plot_gsea(plot_data, descs=descs, colors=DEFAULT_PLOTLY_COLORS_LIST, show_zero_lfc=True, condition_name=cond, base_name=baseline, gene_list_name="log2FC", vertical_spacing=0)
+        fig = plot_gsea(plot_data, descs=descs, colors=DEFAULT_PLOTLY_COLORS_LIST, show_zero_lfc=True, condition_name=cond, base_name=baseline, gene_list_name="log2FC", groups=plot_groups, vertical_spacing=0)
     elif df is None:
         fig = empty_figure("No GSEA file found for dataset")
     else:
         fig = empty_figure("Nothing enriched in this dataset")
 
-    if not switch:
-        fig.update_layout(DARK_LAYOUT)
-        linecolor = "white"
-    else:
-        fig.update_layout(LAYOUT)
-        linecolor = "black"
+    fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
+    linecolor = theme("black", "white")
     fig.update_shapes(line=dict(color=linecolor))
 
 
@@ -582,14 +610,38 @@ def get_gsea_plot(selected_rows, switch, dataset_key, comp):
 @callback(
     Output("deseq-table", "data"),
     Output("deseq-table", "columns"),
+    Output("deseq-table", "page_count"),
+    Output("deseq-table", "page_current"),
+    Output("deseq-table", "selected_rows"),
     Output('volcano-highlight-ids', 'data'),
     Input('dataset-dd', 'value'),
     Input('comparison-dd', 'value'),
+    Input('deseq-table', "page_current"),
+    Input('deseq-table', "page_size"),
+    Input('deseq-table', 'sort_by'),
+    Input('deseq-table', 'filter_query'),
+    State('volcano-highlight-ids', 'data'),
 )
-def update_table_from_dataset(dataset_key, comp):
-    df = get_deseq_result(dataset_key, comp)
+def update_table_from_dataset(dataset_key, comp, current_page, page_size, sort_by, filter_query, highlight_data):
+    _, _, stores = loaded_data()
+    df = get_deseq_result(stores, dataset_key, comp)
+    new_genes = dash.ctx.triggered_id in (None, "dataset-dd", "comparison-dd")
+    if new_genes:
+        # The selection and highlights belong to the genes of the previous comparison
+        highlight_data = {}
+        current_page = 0
+    highlight_data = current_highlight(stores, highlight_data, comp)
+    key = ("analysis", dataset_key, comp)
+    mask = FILTER_ENGINE.mask(key, df, filter_query)
+    rows = FILTER_ENGINE.rows(key, df, mask, sort_by, state=filter_query or "")
+    page_count = max(-(-len(rows) // page_size), 1)
+    current_page = min(current_page, page_count - 1)
+    rows = rows[current_page * page_size:(current_page + 1) * page_size]
+    selected = set(highlight_data.get("Selected", []))
+    selected_rows = [i for i, row in enumerate(rows.tolist()) if row in selected]
+    shown = [i for i, col in enumerate(df.columns) if col not in DERIVED_COLUMNS]
     columns = []
-    for i in df.columns:
+    for i in df.columns[shown]:
         numeric = is_numeric_dtype(df[i])
         if numeric:
             dtype = "numeric"
@@ -611,8 +663,11 @@ def update_table_from_dataset(dataset_key, comp):
         columns.append(d)
 
 
-    data = df.to_dict('records')
-    return data, columns, {}
+    # The rows of the deseq table are the rows of the comparison, so the id of a row is its gene position
+    data = df.iloc[rows, shown].to_dict('records')
+    for row, position in zip(data, rows.tolist()):
+        row["id"] = position
+    return data, columns, page_count, current_page, selected_rows, highlight_data if new_genes else dash.no_update
 
 
 @callback(
@@ -623,7 +678,8 @@ def update_table_from_dataset(dataset_key, comp):
     Input('comparison-dd', 'value'),
 )
 def update_gsea_table_from_dataset(dataset_key, comp):
-    df, _ = get_gsea_result(dataset_key, comp)
+    dash_data, _, _ = loaded_data()
+    df, _, _ = get_gsea_result(dash_data, dataset_key, comp)
     columns = []
     for i in df.columns:
         numeric = is_numeric_dtype(df[i])
@@ -653,15 +709,23 @@ def update_gsea_table_from_dataset(dataset_key, comp):
     Output('volcano-highlight-ids', 'data', allow_duplicate=True),
     Input('deseq-table', 'selected_rows'),
     State('volcano-highlight-ids', 'data'),
-    State('dataset-dd', 'value'),
+    State('deseq-table', 'data'),
     State('comparison-dd', 'value'),
     prevent_initial_call='initial_duplicate'
 
 )
-def add_selected_rows(selected_rows, highlight_data, dataset_key, comp):
-    df = get_deseq_result(dataset_key, comp)
-    indices = df.iloc[selected_rows].index
-    highlight_data["Selected"] = indices
+def add_selected_rows(selected_rows, highlight_data, page_rows, comp):
+    # The table only holds the current page. Its selection replaces the selected genes of the page and keeps the rest.
+    _, _, stores = loaded_data()
+    highlight_data = current_highlight(stores, highlight_data, comp)
+    page_rows = page_rows or []
+    page_ids = {row["id"] for row in page_rows}
+    old = highlight_data.get("Selected", [])
+    selected = [position for position in old if position not in page_ids]
+    selected += [page_rows[i]["id"] for i in selected_rows or []]
+    if set(selected) == set(old) and "Selected" in highlight_data:
+        raise PreventUpdate
+    highlight_data["Selected"] = selected
     return highlight_data
 
 
@@ -671,46 +735,47 @@ def add_selected_rows(selected_rows, highlight_data, dataset_key, comp):
     Input("comparison-dd", "value"),
     Input("enrich-type-dd", "value"),
     Input("enrich-updown-dd", "value"),
-    Input("mode-switch", "value"),
+    State("mode-switch", "value"),
 )
-def create_enrich(dataset_key, comp, enrich_type, updown, switch):
-
-    df = get_enrich_result(dataset_key, comp, enrich_type, updown)
-    cu = UP_COLOR_LIGHT if switch else UP_COLOR_DARK
-    cd = DOWN_COLOR_LIGHT if switch else DOWN_COLOR_DARK
+@cached_figure("enrich", themed=True)
+def create_enrich(dataset_key, comp, enrich_type, updown, theme):
+
+    dash_data, _, _ = loaded_data()
+    parsed = get_parsed_enrich_result(dash_data, dataset_key, comp, enrich_type, updown)
+    df = parsed["df"] if parsed is not None else None
+    cu = theme(UP_COLOR_LIGHT, UP_COLOR_DARK)
+    cd = theme(DOWN_COLOR_LIGHT, DOWN_COLOR_DARK)
     if df is not None and df.shape[0]:
-        fig = enrichment_plot_from_cp_table(df, colorscale=[cu, cd])
+        fig = enrichment_plot_from_cp_table(parsed["plot"], colorscale=[cu, cd], prepared=True)
         height = max(fig.layout.yaxis.range[1] * 20, 450)
         fig.update_layout(
             height=height
         )
     else:
         fig = empty_figure("No enrichment file found or nothing enriched.")
-    if not switch:
-        fig.update_layout(DARK_LAYOUT)
-    else:
-        fig.update_layout(LAYOUT)
+    fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
     return fig
 
 
 @callback(
     Output("correlation-graph", "figure"),
     Input("dataset-dd", "value"),
-    Input("mode-switch", "value"),
+    State("mode-switch", "value"),
 )
-def create_qc(dataset_key, switch):
-
-    df = DASH_DATA[0][dataset_key]["qc"].get("correlation", None)
-    cu = UP_COLOR_LIGHT if switch else UP_COLOR_DARK
-    cd = DOWN_COLOR_LIGHT if switch else DOWN_COLOR_DARK
-    tcol = "black" if switch else "white"
-    bg_col = "white" if switch else None
+@cached_figure("correlation", themed=True)
+def create_qc(dataset_key, theme):
+
+    dash_data, _, _ = loaded_data()
+    df = dash_data[dataset_key]["qc"].get("correlation", None)
+    cu = theme(UP_COLOR_LIGHT, UP_COLOR_DARK)
+    cd = theme(DOWN_COLOR_LIGHT, DOWN_COLOR_DARK)
+    tcol = theme("black", "white")
+    bg_col = theme("white", None)
     if df is not None:
         fig = pheatmap(df, colorscale=[cu, cd], tree_color=tcol, vertical_spacing=0, horizontal_spacing=0)
-        if not switch:
-            fig.update_layout(DARK_LAYOUT)
-        else:
-            fig.update_layout(LAYOUT)
+        fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
+        if bg_col is not None:
+            # Background of the light theme. Figures of both themes drop the fillcolor in the dark one (see apply_theme).
             for p in ["", 4]:
                 fig.add_shape(
                     type='rect',
@@ -728,10 +793,7 @@ def create_qc(dataset_key, switch):
 
     else:
         fig = empty_figure("No Correlation file found for dataset")
-        if not switch:
-            fig.update_layout(DARK_LAYOUT)
-        else:
-            fig.update_layout(LAYOUT)
+        fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
 
     return fig
 
@@ -739,23 +801,21 @@ def create_qc(dataset_key, switch):
 @callback(
     Output("pca-graph", "figure"),
     Input("dataset-dd", "value"),
-    Input("mode-switch", "value"),
+    State("mode-switch", "value"),
 )
-def create_qc(dataset_key, switch):
-    df = DASH_DATA[0][dataset_key]["qc"].get("pca", None)
-    cu = UP_COLOR_LIGHT if switch else UP_COLOR_DARK
-    cd = DOWN_COLOR_LIGHT if switch else DOWN_COLOR_DARK
+@cached_figure("pca", themed=True)
+def create_qc(dataset_key, theme):
+    dash_data, _, _ = loaded_data()
+    df = dash_data[dataset_key]["qc"].get("pca", None)
+    cu = theme(UP_COLOR_LIGHT, UP_COLOR_DARK)
+    cd = theme(DOWN_COLOR_LIGHT, DOWN_COLOR_DARK)
     if df is not None:
-        colors = DEFAULT_PLOTLY_COLORS_LIST
-        colors[0:2] = [cu, cd]
+        colors = [cu, cd] + DEFAULT_PLOTLY_COLORS_LIST[2:]
         fig = sample_pca(df, colors=colors)
         fig.update_traces(marker=dict(size=10))
     else:
         fig = empty_figure("No PCA file found for dataset")
-    if not switch:
-        fig.update_layout(DARK_LAYOUT)
-    else:
-        fig.update_layout(LAYOUT)
+    fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
 
     return fig
 
@@ -769,7 +829,8 @@ def create_qc(dataset_key, switch):
     Input('dataset-dd', 'value'),
 )
 def update_comparisons(dataset_key):
-    comps = list(DASH_DATA[0][dataset_key]["comparisons"].keys())
+    dash_data, _, _ = loaded_data()
+    comps = list(dash_data[dataset_key]["comparisons"].keys())
     selected = comps[0]
     return selected, comps
 
@@ -782,8 +843,9 @@ def update_comparisons(dataset_key):
     State('dataset-dd', 'value'),
 )
 def update_updown_dd(comp, dataset_key):
-    condition = DASH_DATA[0][dataset_key]["comparisons"][comp]["condition"]
-    baseline = DASH_DATA[0][dataset_key]["comparisons"][comp]["baseline"]
+    dash_data, _, _ = loaded_data()
+    condition = dash_data[dataset_key]["comparisons"][comp]["condition"]
+    baseline = dash_data[dataset_key]["comparisons"][comp]["baseline"]
     return condition, [condition, baseline]
 
 
@@ -796,8 +858,9 @@ def update_updown_dd(comp, dataset_key):
     State('add-name-dd', 'value'),
 )
 def update_volcano_column_selections(comp, dataset_key, current_add_name):
-    df = get_deseq_result(dataset_key, comp)
-    columns = list(df.columns)
+    _, _, stores = loaded_data()
+    df = get_deseq_result(stores, dataset_key, comp)
+    columns = [col for col in df.columns if col not in DERIVED_COLUMNS]
     sel = dash.no_update if current_add_name in columns else None
     return sel, columns
 
@@ -813,12 +876,18 @@ def update_volcano_column_selections(comp, dataset_key, current_add_name):
     State("mode-switch", "value"),
 
 )
-def create_volcano(highlight_data, name_col, volcano_type, dataset_key, comp, enrich_term, switch):
+@cached_figure("volcano", themed=True)
+def create_volcano(highlight_data, name_col, volcano_type, dataset_key, comp, enrich_term, theme):
+    dash_data, _, stores = loaded_data()
     highlight = {}
-    for idx, (key, value) in enumerate(highlight_data.items()):
-        highlight[key] = (DEFAULT_PLOTLY_COLORS[key], value)
-    df = get_deseq_result(dataset_key, comp)
-    config = DASH_DATA[0][dataset_key]["config"]
+    for key, value in current_highlight(stores, highlight_data, comp).items():
+        if key != "version":
+            highlight[key] = (DEFAULT_PLOTLY_COLORS[key], np.asarray(value, dtype=np.intp))
+    if "enriched" not in highlight:
+        # The term belongs to dropped positions
+        enrich_term = None
+    df = get_deseq_result(stores, dataset_key, comp)
+    config = dash_data[dataset_key]["config"]
     if volcano_type == "Volcano":
         fig = volcano_from_deseq_result(
             df,
@@ -826,28 +895,41 @@ def create_volcano(highlight_data, name_col, volcano_type, dataset_key, comp, en
             name_col=name_col,
             lfc_cutoff=config["log2FCCutOff"],
             padj_cutoff=config["pAdjCutOff"],
-            condition_name=DASH_DATA[0][dataset_key]["comparisons"][comp]["condition"],
-            base_name=DASH_DATA[0][dataset_key]["comparisons"][comp]["baseline"],
-            highlight_up_color=UP_COLOR_LIGHT if switch else UP_COLOR_DARK,
-            highlight_down_color=DOWN_COLOR_LIGHT if switch else DOWN_COLOR_DARK,
-            opacity=0.1 if switch else 0.25
+            condition_name=dash_data[dataset_key]["comparisons"][comp]["condition"],
+            base_name=dash_data[dataset_key]["comparisons"][comp]["baseline"],
+            highlight_up_color=theme(UP_COLOR_LIGHT, UP_COLOR_DARK),
+            highlight_down_color=theme(DOWN_COLOR_LIGHT, DOWN_COLOR_DARK),
+            opacity=theme(0.1, 0.25),
+            webgl_threshold=CONFIG.get("webgl_threshold", None),
+            density_bins=CONFIG.get("density_bins", 300)
         )
     else:
+        significance = stores[comp].get("significance")
+        significant = None
+        if significance is not None and config.get("pAdjCutOff") is not None:
+            lfc_cutoff = config.get("log2FCCutOff") or 0
+            significant = tuple(
+                significance.mask(significance.get([dataset_key], direction, config["pAdjCutOff"], cutoff, strict=True)[0])
+                for direction, cutoff in (("up", lfc_cutoff), ("down", -lfc_cutoff))
+            )
         fig = ma_from_deseq_result(
             df,
             name_col=name_col,
             highlight=highlight,
             lfc_cutoff=config["log2FCCutOff"],
             padj_cutoff=config["pAdjCutOff"],
-            condition_name=DASH_DATA[0][dataset_key]["comparisons"][comp]["condition"],
-            base_name=DASH_DATA[0][dataset_key]["comparisons"][comp]["baseline"],
-            highlight_up_color=UP_COLOR_LIGHT if switch else UP_COLOR_DARK,
-            highlight_down_color=DOWN_COLOR_LIGHT if switch else DOWN_COLOR_DARK,
+            condition_name=dash_data[dataset_key]["comparisons"][comp]["condition"],
+            base_name=dash_data[dataset_key]["comparisons"][comp]["baseline"],
+            highlight_up_color=theme(UP_COLOR_LIGHT, UP_COLOR_DARK),
+            highlight_down_color=theme(DOWN_COLOR_LIGHT, DOWN_COLOR_DARK),
+            significant=significant,
+            webgl_threshold=CONFIG.get("webgl_threshold", None),
+            density_bins=CONFIG.get("density_bins", 300)
         )
     if enrich_term:
         if volcano_type == "MA":
             sigcolor = DEFAULT_PLOTLY_COLORS["placeholder"]
-            notsigcolor = "#00004a" if switch else "#f6f1e3"
+            notsigcolor = theme("#00004a", "#f6f1e3")
             sig_add = {"marker": dict(color=sigcolor)}
             nsig_add = {"marker": dict(color=notsigcolor)}
         else:
@@ -856,10 +938,7 @@ def create_volcano(highlight_data, name_col, volcano_type, dataset_key, comp, en
         fig.update_traces(selector=dict(name='not-enriched'), legendgroup=enrich_term, legendgrouptitle=dict(text=enrich_term), **nsig_add)
         fig.update_traces(selector=dict(name='enriched'), legendgroup=enrich_term, legendgrouptitle=dict(text=enrich_term), **sig_add)
     fig.update_traces(selector=dict(name='Selected'), legendgroup="Table", legendgrouptitle=dict(text="Table"))
-    if not switch:
-        fig.update_layout(DARK_LAYOUT)
-    else:
-        fig.update_layout(LAYOUT)
+    fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
 
     return fig
 
@@ -872,8 +951,8 @@ def create_volcano(highlight_data, name_col, volcano_type, dataset_key, comp, en
 
 )
 def reset_enrich_selection(n_clicks, current_data):
-    del current_data["enriched"]
-    del current_data["not-enriched"]
+    current_data.pop("enriched", None)
+    current_data.pop("not-enriched", None)
     return True, current_data
 
 
@@ -891,18 +970,19 @@ def reset_enrich_selection(n_clicks, current_data):
 
 )
 def update_volcano_from_enrich(click_data, current_data, dataset_key, comp, enrich_type, updown):
-    enrich = get_enrich_result(dataset_key, comp, enrich_type, updown)
+    dash_data, _, stores = loaded_data()
+    enrich = get_parsed_enrich_result(dash_data, dataset_key, comp, enrich_type, updown)
+    current_data = current_highlight(stores, current_data, comp)
 
     if click_data is not None:
         category = click_data["points"][0]["y"]
-        sdf = enrich[enrich["Description"] == category].iloc[0]
-        ids = set(sdf["geneID"].split("/"))
-        if "universeGeneID" in sdf:
-            ids2 = set(sdf["universeGeneID"].split("/"))
-            ids2 = ids2 - ids2.intersection(ids)
-            current_data["not-enriched"] = list(ids2)
-
-        current_data["enriched"] = list(ids)
+        row = enrich["terms"][category]
+        ids = term_positions(enrich, row)
+        if "universeGeneID" in enrich:
+            ids2 = term_positions(enrich, row, "universeGeneID")
+            current_data["not-enriched"] = np.setdiff1d(ids2, ids, assume_unique=True).tolist()
+
+        current_data["enriched"] = ids.tolist()
         print("CD", current_data)
         return current_data, category, False
     raise PreventUpdate
@@ -910,37 +990,15 @@ def update_volcano_from_enrich(click_data, current_data, dataset_key, comp, enri
 
 
 
-@callback(
-    Output("volcano-graph", "figure", allow_duplicate=True),
-    Input("mode-switch", "value"),
-    State("volcano-graph", "figure"),
-    State("gsea-graph", "figure"),
-    State('volcano-type-dd', 'value'),
-    prevent_initial_call='initial_duplicate'
-
-)
-def patch_all_figures_style(switch_value, f1, f2, volcano_type):
-    upc = UP_COLOR_LIGHT if switch_value else UP_COLOR_DARK
-    downc = DOWN_COLOR_LIGHT if switch_value else DOWN_COLOR_DARK
-    font_color = "black" if switch_value else "white"
-    patched_volcano = Patch()
-    patched_volcano['layout']['font']['color'] = font_color
-    patched_volcano['layout']['xaxis']['linecolor'] = font_color
-    patched_volcano['layout']['yaxis']['linecolor'] = font_color
-
-    patched_volcano["layout"]['plot_bgcolor']= LAYOUT["plot_bgcolor"] if switch_value else DARK_LAYOUT["plot_bgcolor"]
-    if volcano_type == "Volcano":
-        patched_volcano["layout"]["shapes"][0]["fillcolor"] = upc
-        patched_volcano["layout"]["shapes"][0]["opacity"] = 0.1 if switch_value else 0.25
-        patched_volcano["layout"]["annotations"][0]["font"]["color"] = upc
-        patched_volcano["layout"]["shapes"][1]["fillcolor"] = downc
-        patched_volcano["layout"]["shapes"][1]["opacity"] = 0.1 if switch_value else 0.25
-        patched_volcano["layout"]["annotations"][1]["font"]["color"] = downc
-    else:
-        patched_volcano["data"][1]["marker"]["color"] = downc
-        patched_volcano["data"][4]["marker"]["color"] = "#00004a" if switch_value else "#f6f1e3"
-
-    return patched_volcano if f1 is not None else dash.no_update
+# The figures contain the values of both themes (see cached_figure), so switching the theme does not involve the server.
+for graph_id in ("gsea-graph", "enrichment-graph", "correlation-graph", "pca-graph", "volcano-graph"):
+    clientside_callback(
+        ClientsideFunction(namespace="clientside", function_name="apply_theme"),
+        Output(graph_id, "figure", allow_duplicate=True),
+        Input("mode-switch", "value"),
+        State(graph_id, "figure"),
+        prevent_initial_call=True
+    )
 
 
 
@@ -1,40 +1,44 @@
 import dash
 import pandas as pd
-from dash import Input, Output, State, html, dcc, callback, dash_table
+from dash import Input, Output, State, html, dcc, callback, clientside_callback, dash_table, Patch, ClientsideFunction
 import dash_bootstrap_components as dbc
 from dash.dash_table.Format import Format, Scheme
 from pandas.api.types import is_numeric_dtype
-from DEplots.runComparison import plot_gene_among_conditions, upset_plot_from_deseq, compare_two_datasets
+from DEplots.runComparison import plot_gene_among_conditions, upset_plot_from_deseq, compare_two_datasets, \
+    heatmap_gene_among_conditions, significance_classes
 from DEplots.dashboard import DEFAULT_PLOTLY_COLORS, DEFAULT_PLOTLY_COLORS_LIST, LAYOUT, DARK_LAYOUT, UP_COLOR_LIGHT, \
-    UP_COLOR_DARK, DOWN_COLOR_LIGHT, DOWN_COLOR_DARK, DASH_DATA
+    UP_COLOR_DARK, DOWN_COLOR_LIGHT, DOWN_COLOR_DARK, CONFIG, loaded_data
 from DEplots.enrichment import enrichment_plot_from_cp_table, empty_figure, plot_gsea
 import numpy as np
+from DEplots.dashboard.figcache import cached_figure
+from DEplots.dashboard.filtering import FILTER_ENGINE
+from DEplots.dashboard.significance import SignificanceIndex
 
 
 
 dash.register_page(__name__, path='/comparison', name="Comparison")
 
 
-def all_comparisons():
+def all_comparisons(dash_data):
     comps = []
-    for key, value in DASH_DATA[0].items():
-        comp = DASH_DATA[0][key]["comparisons"]
+    for key, value in dash_data.items():
+        comp = dash_data[key]["comparisons"]
         comps += comp
     return list(set(comps))
 
 
-def get_datasets_with_comp(comp):
+def get_datasets_with_comp(dash_data, comp):
     ds = []
-    for key, value in DASH_DATA[0].items():
-        if comp in DASH_DATA[0][key]["comparisons"]:
+    for key, value in dash_data.items():
+        if comp in dash_data[key]["comparisons"]:
             ds.append(key)
     return ds
 
 
-def datasets_card():
-    comps = list(DASH_DATA[1].keys())
+def datasets_card(dash_data, multiindex_data):
+    comps = list(multiindex_data.keys())
     comp = comps[0]
-    sets = get_datasets_with_comp(comp)
+    sets = get_datasets_with_comp(dash_data, comp)
     dataset_card = dbc.Col(
         dbc.Card(
             dbc.Row(
@@ -343,13 +347,13 @@ def get_upset_card(updown):
 
 
 
-def get_layout(dash_data):
+def get_layout(dash_data, multiindex_data):
     lout = html.Div(
         [
             dbc.Container(
                 [
                     dbc.Row(
-                        datasets_card(),
+                        datasets_card(dash_data, multiindex_data),
                         className="py-1"
 
                     ),
@@ -399,32 +403,28 @@ def get_layout(dash_data):
     return lout
 
 
-def upset_fig(datasets, switch, comp, updown):
-    dot_color = "grey" if switch else "rgb(80,80,80)"
+@cached_figure("upset", themed=True)
+def upset_fig(datasets, comp, updown, theme):
+    dot_color = theme("grey", "rgb(80,80,80)")
     if datasets is None or len(datasets) == 0:
         fig = empty_figure("No dataset selected")
     else:
-        idx = pd.IndexSlice
-        df = DASH_DATA[1][comp]
-        df = df.loc[:, idx[datasets, :]]
-        padj_cutoff = DASH_DATA[0][datasets[0]]["config"]["pAdjCutOff"]
+        dash_data, _, stores = loaded_data()
+        store = stores[comp]
+        padj_cutoff = dash_data[datasets[0]]["config"]["pAdjCutOff"]
         if updown == "up":
-            lfc_cutoff = DASH_DATA[0][datasets[0]]["config"]["log2FCCutOff"]
-            barcolor = UP_COLOR_LIGHT if switch else UP_COLOR_DARK
+            lfc_cutoff = dash_data[datasets[0]]["config"]["log2FCCutOff"]
+            barcolor = theme(UP_COLOR_LIGHT, UP_COLOR_DARK)
             dot_colors = (dot_color, barcolor)
 
         else:
-            lfc_cutoff = -DASH_DATA[0][datasets[0]]["config"]["log2FCCutOff"]
-            barcolor = DOWN_COLOR_LIGHT if switch else DOWN_COLOR_DARK
+            lfc_cutoff = -dash_data[datasets[0]]["config"]["log2FCCutOff"]
+            barcolor = theme(DOWN_COLOR_LIGHT, DOWN_COLOR_DARK)
             dot_colors = (dot_color, barcolor)
-        fig = upset_plot_from_deseq(df, padj_cutoff=padj_cutoff, lfc_cutoff=lfc_cutoff, vertical_spacing=0, bar_color=barcolor, dot_colors=dot_colors, horizontal_spacing=0, mode=updown)
+        fig = upset_plot_from_deseq(store, padj_cutoff=padj_cutoff, lfc_cutoff=lfc_cutoff, datasets=datasets, top_k=CONFIG.get("upset_top_k", None), vertical_spacing=0, bar_color=barcolor, dot_colors=dot_colors, horizontal_spacing=0, mode=updown)
         fig.update_yaxes(fixedrange=True, row=2)
-    if not switch:
-        fig.update_layout(DARK_LAYOUT)
-        linecolor = "white"
-    else:
-        fig.update_layout(LAYOUT)
-        linecolor = "black"
+    fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
+    linecolor = theme("black", "white")
     fig.update_yaxes(showline=True, linecolor=linecolor, mirror=True)
     fig.update_xaxes(showline=True, linecolor=linecolor, mirror=True)
     fig.update_xaxes(gridcolor=dot_color, row=2, col=1)
@@ -433,23 +433,23 @@ def upset_fig(datasets, switch, comp, updown):
 @callback(
     Output("upset-up-graph", "figure"),
     Input("dataset-compare-dd", "value"),
-    Input("mode-switch", "value"),
     State("comparison-hash-dd", "value"),
+    State("mode-switch", "value"),
 
 )
-def plot_upset_up(datasets, switch, comp):
-    fig = upset_fig(datasets, switch, comp, "up")
+def plot_upset_up(datasets, comp, switch):
+    fig = upset_fig(datasets, comp, "up", switch)
     return fig
 
 @callback(
     Output("upset-down-graph", "figure"),
     Input("dataset-compare-dd", "value"),
-    Input("mode-switch", "value"),
     State("comparison-hash-dd", "value"),
+    State("mode-switch", "value"),
 
 )
-def plot_upset_down(datasets, switch, comp):
-    fig = upset_fig(datasets, switch, comp, "down")
+def plot_upset_down(datasets, comp, switch):
+    fig = upset_fig(datasets, comp, "down", switch)
     return fig
 
 
@@ -466,9 +466,10 @@ def plot_upset_down(datasets, switch, comp):
 def update_name_selection(comp):
     if comp is None:
         raise dash.exceptions.PreventUpdate
-    datasets = get_datasets_with_comp(comp)
-    options = [f"{col[0]} - {col[1]}" for col in DASH_DATA[1][comp].columns if col[0] not in datasets]
-    data = DASH_DATA[0][datasets[0]]["comparisons"][comp]
+    dash_data, multiindex_data, _ = loaded_data()
+    datasets = get_datasets_with_comp(dash_data, comp)
+    options = [f"{col[0]} - {col[1]}" for col in multiindex_data[comp].columns if col[0] not in datasets]
+    data = dash_data[datasets[0]]["comparisons"][comp]
     condition = data["condition"]
     baseline = data["baseline"]
     tableoptions = [condition, baseline]
@@ -528,7 +529,8 @@ def update_set_on_click(click_data, datasets, comp):
         return dash.no_update
     else:
         sets = s.split("<br>")
-    upreg = DASH_DATA[0][datasets[0]]["comparisons"][comp]["condition"]
+    dash_data, _, _ = loaded_data()
+    upreg = dash_data[datasets[0]]["comparisons"][comp]["condition"]
     return sets, upreg, "exclusive in"
 
 @callback(
@@ -550,44 +552,14 @@ def update_set_on_click(click_data, datasets, comp):
         return dash.no_update
     else:
         sets = s.split("<br>")
-    upreg = DASH_DATA[0][datasets[0]]["comparisons"][comp]["baseline"]
+    dash_data, _, _ = loaded_data()
+    upreg = dash_data[datasets[0]]["comparisons"][comp]["baseline"]
     return sets, upreg, "exclusive in"
 
-operators = [
-    ['contains '],
-    ['ge ', '>='],
-    ['le ', '<='],
-    ['lt ', '<'],
-    ['gt ', '>'],
-    ['ne ', '!='],
-    ['eq ', '='],
-    ['datestartswith ']
-]
-
-
-def split_filter_part(filter_part):
-    for operator_type in operators:
-        for operator in operator_type:
-            if operator in filter_part:
-                name_part, value_part = filter_part.split(operator, 1)
-                print(name_part, value_part, "vname")
-                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
-
-                value_part = value_part.strip()
-                v0 = value_part[0]
-                if (v0 == value_part[-1] and v0 in ("'", '"', '`')):
-                    value = value_part[1: -1].replace('\\' + v0, v0)
-                else:
-                    try:
-                        value = float(value_part)
-                    except ValueError:
-                        value = value_part
-
-                # word operators need spaces after them in the filter string,
-                # but we don't want these later
-                return name, operator_type[0].strip(), value
-
-    return [None] * 3
+def _column(column_id):
+    # The columns of the datasets table are the joined levels of the comparison frame
+    return tuple(column_id.split("_"))
+
 
 @callback(
     Output("datasets-table", "columns"),
@@ -606,86 +578,53 @@ def split_filter_part(filter_part):
 def update_datasets_table(datasets, filter_set, filter_ud, filter_op, current_page, page_size, sort_by, filter_query, comp):
 
     if datasets is None:
-        return None, None
-    idx = pd.IndexSlice
-    df = DASH_DATA[1][comp]
-    df["id"] = range(len(df))
-
-    df = df.loc[:, idx[["id", "Name", "Additional Data"] + datasets, :]]
+        return None, None, 1
+    dash_data, multiindex_data, stores = loaded_data()
+    df = multiindex_data[comp]
     exclusive = filter_op == "exclusive in"
     if filter_set is not None and len(filter_set) == 0:
         filter_set = None
+    # The filtered and sorted rows are cached per filter state, so page flips only slice them
+    state = (filter_query or "",)
+    mask = np.ones(len(df), dtype=bool)
     if filter_ud and filter_set:
-        upreg = DASH_DATA[0][datasets[0]]["comparisons"][comp]["condition"] == filter_ud
-        padj_cutoff = DASH_DATA[0][datasets[0]]["config"]["pAdjCutOff"]
-        lfc_cutoff = DASH_DATA[0][datasets[0]]["config"]["log2FCCutOff"]
-        idx = pd.IndexSlice
-        others = list(set(datasets) - set(filter_set))
-        lfc_idx = idx[datasets, ('log2FoldChange')]
-        pad_idx = idx[datasets, ('padj')]
-        lfc_df = df.loc[:, lfc_idx].droplevel(1, axis=1)
-        padj_df = df.loc[:, pad_idx].droplevel(1, axis=1)
-        if upreg:
-            set_idx = np.all((lfc_df.loc[:, filter_set] >= lfc_cutoff) & (padj_df.loc[:, filter_set] <= padj_cutoff), axis=1)
-            if exclusive:
-                other_idx = np.any((lfc_df.loc[:, others] >= lfc_cutoff) & (padj_df.loc[:, others] <= padj_cutoff), axis=1)
-                set_idx = (set_idx & ~other_idx)
-
-        else:
-            lfc_cutoff = -lfc_cutoff
-            set_idx = np.all((lfc_df.loc[:, filter_set] <= lfc_cutoff) & (padj_df.loc[:, filter_set] <= padj_cutoff),
-                             axis=1)
-            if exclusive:
-                other_idx = np.any((lfc_df.loc[:, others] <= lfc_cutoff) & (padj_df.loc[:, others] <= padj_cutoff), axis=1)
-                set_idx = (set_idx & ~other_idx)
-        df = df[set_idx]
+        upreg = dash_data[datasets[0]]["comparisons"][comp]["condition"] == filter_ud
+        padj_cutoff = dash_data[datasets[0]]["config"]["pAdjCutOff"]
+        lfc_cutoff = dash_data[datasets[0]]["config"]["log2FCCutOff"]
+        significance = stores[comp].get("significance", None) or SignificanceIndex(stores[comp])
+        others = [dataset for dataset in datasets if dataset not in filter_set] if exclusive else []
+        direction, lfc_cutoff = ("up", lfc_cutoff) if upreg else ("down", -lfc_cutoff)
+        set_bits = significance.intersection(filter_set, direction, padj_cutoff, lfc_cutoff, exclude=others)
+        mask &= significance.mask(set_bits)
+        state += (tuple(filter_set), tuple(others), direction, padj_cutoff, lfc_cutoff)
     if filter_query:
-        filtering_expressions = filter_query.split(' && ')
-        for filter_part in filtering_expressions:
-            col_name, operator, filter_value = split_filter_part(filter_part)
-            col_name = tuple(col_name.split("_"))
-
-
-            if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
-                # these operators match pandas series operator method names
-                df = df.loc[getattr(df[col_name], operator)(filter_value)]
-            elif operator == 'contains':
-                df = df.loc[df[col_name].astype(str).str.contains(filter_value, case=False) == True]
-            elif operator == 'datestartswith':
-                # this is a simplification of the front-end filtering logic,
-                # only works with complete fields in standard format
-                df = df.loc[df[col_name].str.startswith(filter_value)]
-    if sort_by:
-        sort_by_filtered = []
-        for i, col in enumerate(sort_by):
-            t = tuple(col["column_id"].split("_"))
-            if t in df.columns:
-                sort_by_filtered.append( sort_by[i] |{"column_id": t})
-        sort_by = sort_by_filtered
-        if len(sort_by):
-            sort_vals = [col['column_id'] for col in sort_by if col["column_id"]]
-            print("sort vals", sort_vals)
-            df = df.sort_values(
-                sort_vals,
-                ascending=[
-                    col['direction'] == 'asc'
-                    for col in sort_by
-                ],
-                inplace=False
-            )
-    page_count = (df.shape[0] // page_size) + 1
-    df = df.iloc[current_page*page_size:(current_page+ 1)*page_size]
+        # Evaluated on all genes of the comparison and cached, so it is independent of the selected datasets
+        mask &= FILTER_ENGINE.mask(("comparison", comp), df, filter_query, column=_column)
+
+    def sort_column(column_id):
+        # Only the columns of the selected datasets are shown and thus sortable
+        col = _column(column_id)
+        return col if col[0] in datasets or col[0] in ("Name", "Additional Data") else None
+
+    rows = FILTER_ENGINE.rows(("comparison", comp), df, mask, sort_by, column=sort_column, state=state)
+    page_count = max(-(-len(rows) // page_size), 1)
+    rows = rows[current_page * page_size:(current_page + 1) * page_size]
+    shown = [i for key in ["Name", "Additional Data"] + datasets for i, col in enumerate(df.columns) if col[0] == key]
+    page = df.iloc[rows, shown]
     columns = [
         {
             "name": i,
-            "id": "_".join(i) if i[0] != "id" else "id",
+            "id": "_".join(i),
             "deletable": False,
             "selectable": False,
             "format": Format(precision=4),
-            "type": "numeric" if is_numeric_dtype(df[i]) else "text"
-        } for i in df.columns if i[0] != "id"
+            "type": "numeric" if is_numeric_dtype(page[i]) else "text"
+        } for i in page.columns
     ]
-    data = [{"_".join(col) if col[0] != "id" else "id": val for col, val in row.items()} for row in df.to_dict('records')]
+    page.columns = ["_".join(col) for col in page.columns]
+    data = page.to_dict('records')
+    for row, position in zip(data, rows.tolist()):
+        row["id"] = position
     return columns, data, page_count
 
 
@@ -697,7 +636,8 @@ def update_datasets_table(datasets, filter_set, filter_ud, filter_op, current_pa
 
 )
 def update_selectable_datasets(comp, dd_state):
-    sets = get_datasets_with_comp(comp)
+    dash_data, _, _ = loaded_data()
+    sets = get_datasets_with_comp(dash_data, comp)
     if dd_state is not None:
         selected = dd_state if all([v in sets for v in dd_state]) else sets
     else:
@@ -707,24 +647,52 @@ def update_selectable_datasets(comp, dd_state):
 @callback(
     Output("two-compare-graph", "figure"),
     Input("two-datasets-to-compare", "value"),
-    Input("mode-switch", "value"),
     Input("plot-hover-name-dd", "value"),
 
     State("comparison-hash-dd", "value"),
+    State("mode-switch", "value"),
 
 )
-def update_compare_two_plot(two_datasets, switch, legend_name, comp):
+def update_compare_two_plot(two_datasets, legend_name, comp, switch):
+    if two_datasets is not None and len(two_datasets) == 2 and \
+            list(dash.ctx.triggered_prop_ids) == ["plot-hover-name-dd.value"]:
+        # Only the hover names changed. The traces are swapped in place instead of rebuilding the figure. If the
+        # datasets or the comparison changed in the same request, the positions of the traces are different.
+        dash_data, multiindex_data, stores = loaded_data()
+        df = multiindex_data[comp]
+        config = dash_data[two_datasets[0]]["config"]
+        names = df.loc[:, tuple(legend_name.split(" - "))].to_numpy()
+        patched = Patch()
+        if config.get("pAdjCutOff") is None:
+            # A single trace of all genes, see compare_two_datasets
+            patched["data"][0]["text"] = names.tolist()
+            return patched
+        codes = significance_classes(
+            stores[comp], two_datasets, config["pAdjCutOff"], config.get("log2FCCutOff") or 0
+        )
+        for code in range(4):
+            patched["data"][code]["text"] = names[codes == code].tolist()
+        return patched
+    return compare_two_fig(two_datasets, legend_name, comp, switch)
+
+
+@cached_figure("compare-two", themed=True)
+def compare_two_fig(two_datasets, legend_name, comp, theme):
     if two_datasets is None or len(two_datasets) != 2:
         fig = empty_figure("Select two datasets")
         return fig
     else:
-        df = DASH_DATA[1][comp]
+        dash_data, multiindex_data, stores = loaded_data()
+        df = multiindex_data[comp]
+        store = stores[comp]
+        config = dash_data[two_datasets[0]]["config"]
         legend_name = tuple(legend_name.split(" - "))
-        fig = compare_two_datasets(df, two_datasets, name_col=legend_name, color=DEFAULT_PLOTLY_COLORS_LIST[1])
-    if not switch:
-        fig.update_layout(DARK_LAYOUT)
-    else:
-        fig.update_layout(LAYOUT)
+        fig = compare_two_datasets(
+            df, two_datasets, name_col=legend_name, color="grey", store=store,
+            padj_cutoff=config.get("pAdjCutOff"), lfc_cutoff=config.get("log2FCCutOff"),
+            class_colors=("grey", DEFAULT_PLOTLY_COLORS_LIST[0], DEFAULT_PLOTLY_COLORS_LIST[3], DEFAULT_PLOTLY_COLORS_LIST[1])
+        )
+    fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
     return fig
 
 
@@ -732,13 +700,14 @@ def update_compare_two_plot(two_datasets, switch, legend_name, comp):
     Output("gene-line-graph", "figure"),
     Input("datasets-table", "derived_virtual_selected_row_ids"),
     Input("dataset-compare-dd", "value"),
-    Input("mode-switch", "value"),
     Input("plot-hover-name-dd", "value"),
 
     State("comparison-hash-dd", "value"),
+    State("mode-switch", "value"),
 
 )
-def update_line_plot(sel_rows, datasets, switch, legend_name, comp):
+@cached_figure("gene-line", themed=True)
+def update_line_plot(sel_rows, datasets, legend_name, comp, theme):
     plot = False
     print(sel_rows, "sel_rows", dash.ctx.triggered_prop_ids)
     if datasets is None or len(datasets) == 0:
@@ -746,26 +715,35 @@ def update_line_plot(sel_rows, datasets, switch, legend_name, comp):
     elif sel_rows is None or len(sel_rows) == 0:
         fig = empty_figure("No gene selected")
     else:
-        idx = pd.IndexSlice
-        df = DASH_DATA[1][comp]
-        df = df.loc[:, idx[["Name", "Additional Data"] + datasets, :]]
-        genes = df.iloc[sel_rows]
+        _, multiindex_data, stores = loaded_data()
+        df = multiindex_data[comp]
+        genes = df.index[sel_rows]
         legend_name = tuple(legend_name.split(" - "))
-        fig = plot_gene_among_conditions(
-            genes,
-            genes=genes.index,
-            runs=datasets,
-            name_col=legend_name,
-            colors=DEFAULT_PLOTLY_COLORS_LIST
-        )
-        fig.update_xaxes()
-        plot = True
-    if not switch:
-        fig.update_layout(DARK_LAYOUT)
-        linecolor = "white"
-    else:
-        fig.update_layout(LAYOUT)
-        linecolor = "black"
+        if len(genes) > CONFIG.get("gene_heatmap_threshold", 10):
+            cu = theme(UP_COLOR_LIGHT, UP_COLOR_DARK)
+            cd = theme(DOWN_COLOR_LIGHT, DOWN_COLOR_DARK)
+            fig = heatmap_gene_among_conditions(
+                df,
+                genes=genes,
+                runs=datasets,
+                name_col=legend_name,
+                colorscale=[cd, theme("white", "black"), cu],
+                store=stores[comp]
+            )
+            fig.update_layout(height=max(450, 20 * len(genes)))
+        else:
+            fig = plot_gene_among_conditions(
+                df,
+                genes=genes,
+                runs=datasets,
+                name_col=legend_name,
+                colors=DEFAULT_PLOTLY_COLORS_LIST,
+                store=stores[comp]
+            )
+            fig.update_xaxes()
+            plot = True
+    fig.update_layout(theme.merge(LAYOUT, DARK_LAYOUT))
+    linecolor = theme("black", "white")
     if plot:
         fig.update_shapes(line=dict(color=linecolor))
         fig.update_traces(
@@ -778,4 +756,18 @@ def update_line_plot(sel_rows, datasets, switch, legend_name, comp):
     return fig
 
 
-layout = get_layout(DASH_DATA[0])
\ No newline at end of file
+def layout(**kwargs):
+    # Created on every page load so that runs added by the run watcher show up
+    dash_data, multiindex_data, _ = loaded_data()
+    return get_layout(dash_data, multiindex_data)
+
+
+# The figures contain the values of both themes (see cached_figure), so switching the theme does not involve the server.
+for graph_id in ("upset-up-graph", "upset-down-graph", "two-compare-graph", "gene-line-graph"):
+    clientside_callback(
+        ClientsideFunction(namespace="clientside", function_name="apply_theme"),
+        Output(graph_id, "figure", allow_duplicate=True),
+        Input("mode-switch", "value"),
+        State(graph_id, "figure"),
+        prevent_initial_call=True
+    )
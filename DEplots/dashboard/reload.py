@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from DEplots.dashboard import get_config_files, read_runs, read_deseq, read_add_data, build_comparisons, \
+    link_enrichment
+from DEplots.dashboard.lazy import TABLE_CACHE, LazyTable
+from DEplots.dashboard.figcache import FIGURE_CACHE
+from DEplots.dashboard.filtering import FILTER_ENGINE
+from DEplots.dashboard.shared import release_shared
+
+PIPELINE_DIRS = ["PipelineData/DESeqResults", "PipelineData/Enrichment", "PipelineData/IntermediateData"]
+
+
+def run_fingerprint(file: str):
+    """ Size and modification time of the run config and of every pipeline table belonging to the run"""
+    stat = os.stat(file)
+    fingerprint = {file: (stat.st_size, stat.st_mtime_ns)}
+    dirname = os.path.dirname(file)
+    for subdir in PIPELINE_DIRS:
+        directory = os.path.join(dirname, subdir)
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    fingerprint[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return fingerprint
+
+
+def snapshot(config):
+    """ Fingerprints all runs of the config. Runs without a readable config file are skipped."""
+    snap = {}
+    for name, file in get_config_files(config).items():
+        try:
+            snap[name] = (file, run_fingerprint(file))
+        except OSError:
+            continue
+    return snap
+
+
+def _deseq_changed(old, new):
+    paths = set(old) | set(new)
+    return any(
+        old.get(path) != new.get(path) for path in paths
+        if path.endswith("config.yml") or os.path.basename(os.path.dirname(path)) == "DESeqResults"
+    )
+
+
+def _copy_entry(entry, comps):
+    """ Copy of a dash_data entry whose comparisons in comps can be rebuilt without modifying entry"""
+    comparisons = dict(entry["comparisons"])
+    for comp in comps:
+        comparison = dict(comparisons[comp])
+        comparison["enrich"] = {
+            enrich: {
+                name: None if handle is None else LazyTable(handle.loader, handle.cache, handle.prepare)
+                for name, handle in handles.items()
+            }
+            for enrich, handles in comparison["enrich"].items()
+        }
+        comparisons[comp] = comparison
+    return dict(entry, comparisons=comparisons)
+
+
+def update_runs(data, config, old, new, load_workers: int = 1):
+    """ Replaces the dashboard data with a version containing the runs that changed between two snapshots
+
+    Only changed or new runs are read again. The comparison frames are rebuilt if a run containing the comparison
+    was added, removed or its DESeq results changed. For this, the DESeq results of the unchanged runs are read
+    again, which is cheap if a cache_dir is configured. The new version is built from copies of the changed
+    entries and published by replacing all items of data at once. Callbacks that read data via loaded_data thus
+    either see the old or the new version. Gene positions held by the clients are dropped if the genes of their comparison changed (see
+    genes_version).
+
+    Args:
+        data (List[dict, dict, dict]): The data returned by read_files. Its items are replaced.
+        config (dict): dashboard config
+        old (dict): snapshot of the runs that data currently represents
+        new (dict): current snapshot of the runs
+        load_workers (int): Number of threads used to read the changed runs.
+
+    Returns:
+        bool: whether anything changed
+
+    """
+    dash_data, multiindex_data, stores = data
+    changed = {name: file for name, (file, fingerprint) in new.items() if name not in old or old[name] != new[name]}
+    removed = [name for name in old if name not in new and name in dash_data]
+    if not changed and not removed:
+        return False
+    with ThreadPoolExecutor(max_workers=max(load_workers, 1)) as pool:
+        runs = read_runs(config, changed, pool)
+
+    affected = set()
+    for name in removed:
+        affected.update(dash_data[name]["comparisons"])
+    for name, (entry, deseq) in runs.items():
+        old_comps = dash_data[name]["comparisons"] if name in dash_data else {}
+        if name not in old or _deseq_changed(old[name][1], new[name][1]):
+            affected.update(old_comps)
+            affected.update(deseq)
+        else:
+            for comp in deseq:
+                entry["comparisons"][comp]["deseq"] = old_comps[comp]["deseq"]
+
+    order = [name for name in dash_data if name not in removed] + [name for name in runs if name not in dash_data]
+    new_dash_data = {}
+    fresh = {}
+    subset = {}
+    for name in order:
+        if name in runs:
+            entry, deseq = runs[name]
+            deseq = {comp: df for comp, df in deseq.items() if comp in affected}
+            fresh[name] = entry
+        else:
+            comps = affected.intersection(dash_data[name]["comparisons"])
+            entry = _copy_entry(dash_data[name], comps) if comps else dash_data[name]
+            deseq = read_deseq(config, new[name][0], entry["config"], comps) if comps else {}
+            if comps:
+                fresh[name] = entry
+        new_dash_data[name] = entry
+        if deseq:
+            subset[name] = (entry, deseq)
+    frames, new_stores = build_comparisons(subset, read_add_data(config), config)
+
+    new_multiindex = {}
+    new_store_data = {}
+    for comp in list(multiindex_data) + [comp for comp in frames if comp not in multiindex_data]:
+        if comp in frames:
+            new_multiindex[comp] = frames[comp]
+            new_store_data[comp] = new_stores[comp]
+        elif comp not in affected:
+            new_multiindex[comp] = multiindex_data[comp]
+            new_store_data[comp] = stores[comp]
+    link_enrichment(fresh, new_store_data)
+    data[:] = (new_dash_data, new_multiindex, new_store_data)
+    in_use = {store.get("shared_prefix") for store in new_store_data.values()}
+    for comp in affected.intersection(stores):
+        prefix = stores[comp].get("shared_prefix")
+        if prefix and prefix not in in_use:
+            release_shared(prefix)
+    TABLE_CACHE.clear()
+    FIGURE_CACHE.clear()
+    FILTER_ENGINE.clear()
+    print(f"Reloaded runs {sorted(changed)}, removed runs {removed}, rebuilt comparisons {sorted(frames)}")
+    return True
+
+
+def watch_runs(data, config, interval: float = 30, load_workers: int = 1):
+    """ Starts a background thread that polls the runs of the config and patches data if they change
+
+    Polling only uses os.stat and os.scandir and thus works on every OS and on network filesystems. Since the page
+    layouts are created on every page load, new runs and comparisons show up in the dropdowns after a refresh.
+
+    Args:
+        data (List[dict, dict, dict]): The data returned by read_files. Its items are replaced on changes.
+        config (dict): dashboard config
+        interval (float): Seconds between two polls.
+        load_workers (int): Number of threads used to read the changed runs.
+
+    Returns:
+        threading.Thread: the started daemon thread
+
+    """
+    def _watch():
+        old = snapshot(config)
+        while True:
+            time.sleep(interval)
+            try:
+                new = snapshot(config)
+                update_runs(data, config, old, new, load_workers)
+                old = new
+            except Exception as e:
+                # Files might still be written by the pipeline. The changes are picked up by the next poll.
+                print(f"Reloading runs failed: {e!r}")
+    thread = threading.Thread(target=_watch, name="DEplots-run-watcher", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,109 @@
+import atexit
+import hashlib
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_float_dtype, is_integer_dtype
+
+DEFAULT_SHARED_DIR = "/dev/shm/deplots" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "deplots")
+# Files written or attached by this process. They are removed when it exits or their comparison is replaced.
+SHARED_FILES = set()
+_OWNER = os.getpid()
+
+
+def share_array(values: np.ndarray, file: str):
+    """ Returns a read-only memory map of file holding values
+
+    If file already holds values, e.g. because another worker loaded the same data, it is attached instead of being
+    written again.
+    """
+    if os.path.isfile(file):
+        try:
+            mapped = np.load(file, mmap_mode="r")
+            if mapped.shape == values.shape and mapped.dtype == values.dtype and \
+                    np.array_equal(mapped, values, equal_nan=is_float_dtype(values.dtype)):
+                SHARED_FILES.add(file)
+                return np.asarray(mapped)
+        except ValueError:
+            pass
+    directory = os.path.dirname(file)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as handle:
+        np.save(handle, values)
+    os.replace(tmp, file)
+    SHARED_FILES.add(file)
+    return np.asarray(np.load(file, mmap_mode="r"))
+
+
+def shared_prefix(directory, key, sources=()):
+    """ Path prefix of the memory mapped files of key
+
+    Args:
+        directory (str): Directory of the files. Defaults to /dev/shm/deplots if it is not a str.
+        key (str): The comparison.
+        sources (Iterable[str]): The files the data of key is read from. Their resolved paths and modification times
+            are part of the prefix, so deployments of different runs or versions of the files do not share files.
+
+    """
+    directory = directory if isinstance(directory, str) else DEFAULT_SHARED_DIR
+    stamps = []
+    for source in sorted(os.path.realpath(source) for source in sources):
+        stat = os.stat(source)
+        stamps.append((source, stat.st_size, stat.st_mtime_ns))
+    return os.path.join(directory, hashlib.sha1(repr((str(key), stamps)).encode()).hexdigest())
+
+
+def share_frame(df: pd.DataFrame, prefix: str, shared=()):
+    """ Moves the numeric columns of a DataFrame into memory mapped .npy files
+
+    The numeric columns are grouped by dtype and each group is stored as one file via share_array. Processes that
+    map the same file share its pages instead of holding private copies.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to share.
+        prefix (str): Path prefix of the .npy files. The dtype name is appended.
+        shared (Iterable[np.ndarray]): Already shared arrays. Columns that are views into them are kept as they are.
+
+    Returns:
+        pd.DataFrame: A DataFrame equal to df whose numeric columns are read-only views into the memory maps
+
+    """
+    groups = {}
+    for i, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, np.dtype) and (is_float_dtype(dtype) or is_integer_dtype(dtype)):
+            values = df.iloc[:, i].to_numpy()
+            if not any(np.may_share_memory(values, array) for array in shared):
+                groups.setdefault(dtype, []).append(i)
+    columns = {i: df.iloc[:, i] for i in range(df.shape[1])}
+    for dtype, positions in groups.items():
+        values = np.ascontiguousarray(df.iloc[:, positions].to_numpy(dtype=dtype).T)
+        mapped = share_array(values, f"{prefix}_{dtype.name}.npy")
+        for row, i in enumerate(positions):
+            columns[i] = mapped[row]
+    frame = pd.DataFrame(columns, index=df.index, copy=False)
+    frame.columns = df.columns
+    return frame
+
+
+def _remove(file: str):
+    SHARED_FILES.discard(file)
+    try:
+        os.remove(file)
+    except OSError:
+        pass
+
+
+def release_shared(prefix: str):
+    """ Removes the memory mapped files of prefix. Arrays that are already mapped from them stay valid."""
+    for file in [file for file in SHARED_FILES if file.startswith(f"{prefix}_")]:
+        _remove(file)
+
+
+@atexit.register
+def _release_all():
+    # Processes forked by the server inherit SHARED_FILES, but only the process that loaded the data removes them
+    if os.getpid() == _OWNER:
+        for file in list(SHARED_FILES):
+            _remove(file)
@@ -0,0 +1,65 @@
+import numpy as np
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class SignificanceIndex:
+    """ Packed bitsets of the significant genes of every dataset of a comparison
+
+    Each bitset covers all genes of the comparison store in its row order. Bitsets are keyed by direction and cutoffs.
+    Up-regulated genes have a log2FoldChange >= lfc_cutoff, down-regulated ones <= lfc_cutoff, where the lfc_cutoff
+    of down-regulated genes is usually negative. strict uses > and < instead. All genes additionally need a
+    padj <= padj_cutoff. The bitsets of the configured cutoffs are built on creation, all others on first use.
+
+    Args:
+        store (dict): Comparison store as returned by build_store.
+        cutoffs (Iterable[Tuple[float, float]]): The configured (pAdjCutOff, log2FCCutOff) pairs.
+
+    """
+    def __init__(self, store: dict, cutoffs=()):
+        self.store = store
+        self.n_genes = len(store["genes"])
+        self._bits = {}
+        for padj_cutoff, lfc_cutoff in cutoffs:
+            for strict in (False, True):
+                self.bits("up", padj_cutoff, lfc_cutoff, strict)
+                self.bits("down", padj_cutoff, -lfc_cutoff, strict)
+
+    def bits(self, direction: str, padj_cutoff: float, lfc_cutoff: float, strict: bool = False):
+        """ Returns a datasets x ceil(genes / 8) uint8 array of packed bitsets"""
+        key = (direction, padj_cutoff, lfc_cutoff, strict)
+        bits = self._bits.get(key)
+        if bits is None:
+            lfc = self.store["arrays"]["log2FoldChange"]
+            padj = self.store["arrays"]["padj"]
+            if direction == "up":
+                significant = lfc > lfc_cutoff if strict else lfc >= lfc_cutoff
+            elif direction == "down":
+                significant = lfc < lfc_cutoff if strict else lfc <= lfc_cutoff
+            else:
+                raise ValueError(f"direction must be up or down not {direction}")
+            significant &= padj <= padj_cutoff
+            bits = np.packbits(significant.T, axis=1)
+            self._bits[key] = bits
+        return bits
+
+    def get(self, datasets, direction: str, padj_cutoff: float, lfc_cutoff: float, strict: bool = False):
+        """ Returns the packed bitsets of the given datasets"""
+        idx = [self.store["dataset_idx"][dataset] for dataset in datasets]
+        return self.bits(direction, padj_cutoff, lfc_cutoff, strict)[idx]
+
+    def intersection(self, datasets, direction: str, padj_cutoff: float, lfc_cutoff: float, exclude=(), strict: bool = False):
+        """ Packed bitset of genes significant in all datasets and, if exclude is given, in none of the excluded"""
+        bits = np.bitwise_and.reduce(self.get(datasets, direction, padj_cutoff, lfc_cutoff, strict), axis=0)
+        if len(exclude):
+            bits &= ~np.bitwise_or.reduce(self.get(exclude, direction, padj_cutoff, lfc_cutoff, strict), axis=0)
+        return bits
+
+    def mask(self, bits: np.ndarray):
+        """ Unpacks a bitset or an array of bitsets to a boolean mask over the genes"""
+        return np.unpackbits(bits, axis=-1, count=self.n_genes).view(bool)
+
+
+def count(bits: np.ndarray):
+    """ Number of set bits in the last axis of packed bitsets"""
+    return POPCOUNT[bits].sum(axis=-1, dtype=np.int64)
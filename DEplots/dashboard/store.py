@@ -0,0 +1,115 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+STATISTICS = ["baseMean", "log2FoldChange", "lfcSE", "pvalue", "padj"]
+NON_DATASET_KEYS = ("Name", "Additional Data")
+DERIVED_COLUMNS = ("-log10padj", "log10BaseMean")
+
+
+def build_store(df: pd.DataFrame, allocate=None):
+    """ Builds a dense genes x datasets array per statistic from a comparison frame
+
+    Each statistic uses the common dtype of its columns, so statistics that were compacted to float32 stay float32
+    while e.g. adjusted p-values that need float64 keep it. All statistic columns of the returned frame are views
+    into the arrays, so the store does not need additional memory. A column whose dtype differs from the one of its
+    statistic is replaced by the view in the wider dtype instead of being kept twice.
+
+    Args:
+        df (pd.DataFrame): MultiIndex frame of a comparison as built by build_comparisons.
+        allocate (callable): Optional function mapping a filled array and the name of its statistic to the array that
+            is finally used, e.g. a memory mapped copy of it.
+
+    Returns:
+        Tuple[pd.DataFrame, dict]: The frame using views into the arrays and the store. The store contains the
+        genes index, the list of datasets, a dataset -> position lookup, the statistics, a statistic -> array
+        lookup under the "arrays" key and the version of the gene order (see genes_version).
+
+    """
+    datasets = [key for key in df.columns.get_level_values(0).unique() if key not in NON_DATASET_KEYS]
+    arrays = {}
+    for statistic in STATISTICS:
+        present = [(dataset, statistic) for dataset in datasets if (dataset, statistic) in df.columns]
+        dtype = np.result_type(*set(df[present].dtypes)) if present else np.float64
+        array = np.full((df.shape[0], len(datasets)), np.nan, dtype=dtype)
+        for j, dataset in enumerate(datasets):
+            if (dataset, statistic) in df.columns:
+                array[:, j] = df[(dataset, statistic)].to_numpy(dtype=dtype)
+        if allocate is not None:
+            array = allocate(array, statistic)
+        arrays[statistic] = array
+
+    views = {}
+    for i, col in enumerate(df.columns):
+        if col[0] in datasets and col[1] in STATISTICS:
+            views[i] = arrays[col[1]][:, datasets.index(col[0])]
+        else:
+            views[i] = df.iloc[:, i]
+    frame = pd.DataFrame(views, index=df.index, copy=False)
+    frame.columns = df.columns
+    # Builds the hash table of the gene index at load time instead of in the first request resolving gene IDs to row
+    # positions. get_indexer needs unique genes.
+    if df.index.is_unique:
+        df.index.get_indexer(df.index[:1])
+    store = {
+        "genes": df.index,
+        "datasets": datasets,
+        "dataset_idx": {dataset: j for j, dataset in enumerate(datasets)},
+        "statistics": STATISTICS,
+        "arrays": arrays,
+        "version": genes_version(df.index),
+    }
+    return frame, store
+
+
+def genes_version(genes: pd.Index):
+    """ Hash of the gene order of a comparison
+
+    Gene positions stored by the clients are only valid as long as the version of their comparison is the same. It
+    only depends on the genes, so all worker processes agree on it and reloads that keep the genes keep it.
+    """
+    return hashlib.sha1(pd.util.hash_pandas_object(genes, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def get_values(store: dict, datasets, statistic: str):
+    """ Returns a genes x datasets array of one statistic for the given datasets"""
+    idx = [store["dataset_idx"][dataset] for dataset in datasets]
+    return store["arrays"][statistic][:, idx]
+
+
+def _read_only(values: np.ndarray):
+    values.setflags(write=False)
+    return values
+
+
+def build_projections(df: pd.DataFrame, store: dict):
+    """ Builds the flat single dataset views of a comparison frame
+
+    Each view holds the Name, dataset and Additional Data columns of one dataset with the first column level dropped
+    and a Gene column moved to the front. The columns are the ones of df, so no data is copied. The derived
+    DERIVED_COLUMNS used by the volcano and MA plots are appended as read-only arrays.
+
+    Args:
+        df (pd.DataFrame): MultiIndex frame of a comparison as returned by build_store.
+        store (dict): The store of the comparison.
+
+    Returns:
+        dict: a DataFrame per dataset of the comparison
+
+    """
+    projections = {}
+    for dataset in store["datasets"]:
+        cols = [col for key in ("Name", dataset, "Additional Data") for col in df.columns if col[0] == key]
+        names = [col[1] for col in cols]
+        if "Gene" in names:
+            order = [0, names.index("Gene")] + [i for i, name in enumerate(names) if i and name != "Gene"]
+            cols = [cols[i] for i in order]
+            names = [names[i] for i in order]
+        columns = {i: df[col] for i, col in enumerate(cols)}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            columns[len(columns)] = _read_only(-1 * np.log10(get_values(store, [dataset], "padj")[:, 0]))
+            columns[len(columns)] = _read_only(np.log10(get_values(store, [dataset], "baseMean")[:, 0]))
+        frame = pd.DataFrame(columns, index=df.index, copy=False)
+        frame.columns = names + list(DERIVED_COLUMNS)
+        projections[dataset] = frame
+    return projections
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+import pandas as pd
+
+CACHE_DIRNAME = ".deplots_cache"
+
+
+def _cache_location(file: str, cache_dir, **kwargs):
+    file = os.path.abspath(file)
+    stat = os.stat(file)
+    if cache_dir is True:
+        directory = os.path.join(os.path.dirname(file), CACHE_DIRNAME)
+    else:
+        directory = cache_dir
+    key = hashlib.sha1(f"{file}{sorted(kwargs.items())}".encode()).hexdigest()
+    return directory, key, f"{key}_{stat.st_size}_{stat.st_mtime_ns}.pkl"
+
+
+def read_table(file: str, cache_dir=False, **kwargs):
+    """ Reads a tab separated table and caches the parsed DataFrame on disk
+
+    Cache entries are keyed by the absolute source path, its size and its modification time. If any of these changes
+    the table is parsed again and the outdated entry is replaced.
+
+    Args:
+        file (str): Path to the tab separated file.
+        cache_dir (str | bool): Directory used to store the parsed tables. If True, the cache is stored in a
+            .deplots_cache directory next to the file. If False, the file is parsed without caching.
+        **kwargs: passed to pandas read_csv function
+
+    Returns:
+        pd.DataFrame: the parsed table
+
+    """
+    if not cache_dir:
+        return pd.read_csv(file, sep="\t", **kwargs)
+    directory, key, name = _cache_location(file, cache_dir, **kwargs)
+    cache_file = os.path.join(directory, name)
+    if os.path.isfile(cache_file):
+        try:
+            return pd.read_pickle(cache_file)
+        except Exception as e:
+            print(f"Unable to load cached table {cache_file}: {e}")
+    df = pd.read_csv(file, sep="\t", **kwargs)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{key}", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                df.to_pickle(handle, protocol=5)
+            os.replace(tmp, cache_file)
+        finally:
+            # Left behind if pickling or replacing failed, e.g. for tables that cannot be pickled
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        for entry in os.listdir(directory):
+            if entry.startswith(key) and entry != name:
+                os.remove(os.path.join(directory, entry))
+    except OSError as e:
+        print(f"Unable to cache {file} in {directory}: {e}")
+    return df
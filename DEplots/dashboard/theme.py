@@ -0,0 +1,130 @@
+from DEplots.dashboard.transport import dumps, loads
+
+THEME_KEY = "theme_values"
+# Valid CSS color with a digit sequence no real figure uses. The index of the value is appended.
+PLACEHOLDER_COLOR = "rgba(0,0,0,0.31415926{:04d})"
+PLACEHOLDER_OFFSET = 1e-12
+
+
+def to_dict(fig):
+    """ JSON compatible dict of a plotly Figure or figure dict"""
+    return loads(dumps(fig))
+
+
+class Theme:
+    """ Values of the light and dark theme used while building a figure
+
+    Themed callbacks (see cached_figure) receive a Theme instead of the value of the mode-switch and look up every
+    value that differs between the themes via theme(light, dark). A Theme of a single theme returns the values of
+    that theme. The Theme used by themed_figure returns placeholders instead and records their values, so that the
+    paths of the themed values are known after building the figure once.
+
+    Args:
+        switch (bool): The value of the mode-switch (True for light) or None to record placeholders.
+
+    """
+    def __init__(self, switch: bool = None):
+        self.switch = switch
+        self.values = {}
+
+    def __call__(self, light, dark):
+        if self.switch is not None:
+            return light if self.switch else dark
+        if light == dark:
+            return light
+        if isinstance(light, str):
+            placeholder = PLACEHOLDER_COLOR.format(len(self.values))
+        elif isinstance(light, float):
+            placeholder = light + PLACEHOLDER_OFFSET * (len(self.values) + 1)
+        else:
+            raise TypeError(f"Only colors and floats can differ between the themes, got {light!r}")
+        self.values[placeholder] = (light, dark)
+        return placeholder
+
+    def merge(self, light: dict, dark: dict):
+        """ Combines two dicts, e.g. LAYOUT and DARK_LAYOUT, into one whose differing values are themed"""
+        merged = {}
+        for key in list(light) + [key for key in dark if key not in light]:
+            lv, dv = light.get(key), dark.get(key)
+            merged[key] = self.merge(lv, dv) if isinstance(lv, dict) and isinstance(dv, dict) else self(lv, dv)
+        return merged
+
+
+def resolve_theme(figure, values: dict, path=()):
+    """ Replaces the placeholders of a Theme in a figure dict with their light value
+
+    Args:
+        figure (dict | list): JSON compatible figure dict or one of its containers.
+        values (dict): The values recorded by the Theme.
+        path (tuple): Path of figure within the whole figure.
+
+    Returns:
+        list: the [path, light value, dark value] of every replaced placeholder. Arrays containing placeholders, e.g.
+        marker colors, are listed as a whole.
+
+    """
+    differences = []
+    if isinstance(figure, dict):
+        items = figure.items()
+    else:
+        try:
+            contained = not values.keys().isdisjoint(figure)
+        except TypeError:
+            # Unhashable elements, i.e. the list holds containers
+            contained = None
+        if contained is not None:
+            if contained:
+                light = [values[value][0] if value in values else value for value in figure]
+                dark = [values[value][1] if value in values else value for value in figure]
+                figure[:] = light
+                differences.append([list(path), list(light), dark])
+            return differences
+        items = enumerate(figure)
+    for key, value in items:
+        if isinstance(value, (dict, list)):
+            differences += resolve_theme(value, values, path + (key,))
+        elif isinstance(value, (str, float)) and value in values:
+            figure[key] = values[value][0]
+            differences.append([list(path + (key,)), values[value][0], values[value][1]])
+    return differences
+
+
+def themed_figure(build):
+    """ Builds a figure that can be switched between the light and dark theme without the server
+
+    build is called once with a recording Theme. The light figure is returned and the paths and values of all themed
+    properties are stored in layout.meta, from where apply_theme (or the apply_theme function in clientside.js)
+    swaps them.
+
+    Args:
+        build (callable): Function taking a Theme and returning the figure.
+
+    Returns:
+        dict: the light figure as a JSON compatible dict
+
+    """
+    theme = Theme()
+    figure = to_dict(build(theme))
+    differences = resolve_theme(figure, theme.values)
+    layout = figure.setdefault("layout", {})
+    meta = layout.get("meta")
+    layout["meta"] = dict(meta if isinstance(meta, dict) else {}, **{THEME_KEY: differences})
+    return figure
+
+
+def apply_theme(figure: dict, switch: bool):
+    """ Sets the theme values of a figure created by themed_figure in place and returns it"""
+    position = 1 if switch else 2
+    for entry in figure.get("layout", {}).get("meta", {}).get(THEME_KEY, []):
+        path, value = entry[0], entry[position]
+        target = figure
+        for key in path[:-1]:
+            if isinstance(target, dict):
+                target = target.setdefault(key, {})
+            else:
+                target = target[key]
+        if isinstance(target, dict) and value is None:
+            target.pop(path[-1], None)
+        else:
+            target[path[-1]] = value
+    return figure
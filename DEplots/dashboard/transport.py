@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import json
+from flask import request
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+from plotly.utils import PlotlyJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_ENCODER = PlotlyJSONEncoder()
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson is not None else None
+
+COMPRESSIBLE = (
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "image/svg+xml",
+)
+
+
+def set_json_engine(fast: bool):
+    """ Selects the JSON engine of plotly, which is used for the callback responses of Dash and the figure cache
+
+    Args:
+        fast (bool): Use orjson if it is installed. Otherwise, the default engine of plotly is kept for the callback
+            responses and the figure cache uses the json module of the standard library.
+
+    """
+    pio.json.config.default_engine = "orjson" if fast and orjson is not None else "auto"
+
+
+def dumps(obj) -> str:
+    """ Serializes figures, figure dicts and table records using the JSON engine selected via set_json_engine
+
+    Unlike plotly, objects orjson cannot serialize natively, e.g. arrays of strings, are converted one by one via the
+    PlotlyJSONEncoder instead of cleaning the whole figure first.
+    """
+    if orjson is None or pio.json.config.default_engine != "orjson":
+        return to_json_plotly(obj, engine="json")
+    if hasattr(obj, "to_plotly_json"):
+        obj = obj.to_plotly_json()
+    return orjson.dumps(obj, default=_ENCODER.default, option=ORJSON_OPTIONS).decode()
+
+
+def loads(value: str):
+    if orjson is not None and pio.json.config.default_engine == "orjson":
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(body: bytes, encoding: str, level: int = 4) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def enable_compression(server, level: int = 4, min_size: int = 500, budget: int = 32 * 2 ** 20):
+    """ Compresses the responses of the flask server if the client accepts it
+
+    Responses are compressed with brotli if it is installed and accepted by the client and with gzip otherwise. Only
+    text responses, e.g. the JSON of the callbacks and the javascript bundles, of at least min_size bytes are
+    compressed. Compressed bodies are kept in a FigureCache keyed by the hash of the uncompressed body, so figures
+    served from the figure cache are not compressed again.
+
+    Args:
+        server (flask.Flask): The server of the Dash app.
+        level (int): Compression level of gzip (1-9) and quality of brotli (0-11).
+        min_size (int): Responses smaller than this number of bytes are sent uncompressed.
+        budget (int): Memory budget in bytes of the cached compressed bodies.
+
+    """
+    from DEplots.dashboard.figcache import FigureCache
+    cache = FigureCache(budget)
+
+    @server.after_request
+    def compress_response(response):
+        response.vary.add("Accept-Encoding")
+        if not 200 <= response.status_code < 300 or response.status_code == 204 or response.is_streamed or \
+                "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE:
+            return response
+        accepted = request.accept_encodings
+        encoding = next((encoding for encoding in available_encodings() if accepted[encoding]), None)
+        if encoding is None:
+            return response
+        response.direct_passthrough = False
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        key = (encoding, hashlib.sha1(body).digest())
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress(body, encoding, level)
+            cache.put(key, compressed)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+    return compress_response
@@ -7,17 +7,44 @@ HOVERTEMPLATE = '<i>Y</i>: %{y:.2f}' + \
                 '<br><b>X</b>: %{x}<br>' + \
                 '<b>%{text}</b>'
 
-def _internal_plot_fct(df, x: str = "log2FoldChange", y: str = "-log10padj", highlight = None, name_col: str = None):
+def _density_mask(x: np.ndarray, y: np.ndarray, bins: int):
+    # Keeps one point per occupied cell of a bins x bins grid. Dense regions are thinned while sparse outliers stay.
+    mask = ~(np.isfinite(x) & np.isfinite(y))
+    finite = np.flatnonzero(~mask)
+    if finite.size == 0:
+        return mask
+    cells = np.zeros(finite.size, dtype=np.int64)
+    for values in (x[finite], y[finite]):
+        low, high = values.min(), values.max()
+        span = (high - low) if high > low else 1
+        cells = cells * bins + np.minimum(((values - low) / span * bins).astype(np.int64), bins - 1)
+    _, first = np.unique(cells, return_index=True)
+    mask[finite[first]] = True
+    return mask
+
+
+def _internal_plot_fct(
+        df,
+        x: str = "log2FoldChange",
+        y: str = "-log10padj",
+        highlight = None,
+        name_col: str = None,
+        webgl_threshold: int = None,
+        density_bins: int = 300,
+        exact: np.ndarray = None
+):
+    webgl = webgl_threshold is not None and df.shape[0] > webgl_threshold
+    scatter = go.Scattergl if webgl else go.Scatter
     fig = go.Figure()
     not_highlighted = []
     if highlight is not None:
         for key, value in highlight.items():
             color, names = value
-            mask = df.index.isin(names)
+            mask = names if isinstance(names, np.ndarray) and names.dtype == bool else df.index.isin(names)
             to_highlight = df[mask]
             n = ~mask
             not_highlighted.append(n)
-            fig.add_trace(go.Scatter(
+            fig.add_trace(scatter(
                 x=to_highlight[x],
                 y=to_highlight[y],
                 mode="markers",
@@ -27,11 +54,15 @@ def _internal_plot_fct(df, x: str = "log2FoldChange", y: str = "-log10padj", hig
                 name=key,
                 showlegend=True
             ))
-    if len(not_highlighted) >= 1:
-        remaining = df[np.logical_and.reduce(not_highlighted)]
-    else:
-        remaining = df
-    fig.add_trace(go.Scatter(
+    rest = np.logical_and.reduce(not_highlighted) if len(not_highlighted) >= 1 else np.ones(df.shape[0], dtype=bool)
+    if webgl:
+        # Only the background is thinned. Highlighted points and points in exact, e.g. significant ones, are kept.
+        thin = _density_mask(df[x].to_numpy(dtype=float)[rest], df[y].to_numpy(dtype=float)[rest], density_bins)
+        if exact is not None:
+            thin |= exact[rest]
+        rest[rest] = thin
+    remaining = df[rest]
+    fig.add_trace(scatter(
         x=remaining[x],
         y=remaining[y],
         mode="markers",
@@ -54,15 +85,19 @@ def ma_from_deseq_result(
         base_name: str = None,
         highlight_up_color: str = "#2ca02c",
         highlight_down_color: str = "#002695",
+        significant: Tuple[np.ndarray, np.ndarray] = None,
+        webgl_threshold: int = None,
+        density_bins: int = 300,
 ):
     """ Creates an MA scatter plot from a deseq result table read as pandas Dataframe.
 
     Args:
         deseq_result (pd.DataFrame): The DESeq2 output read as a pandas dataframe containing at least all columns
-            from a DESeq2 run
+            from a DESeq2 run. A precomputed log10BaseMean column is used if present.
         name_col (str): Name of the column displayed on point hover
         highlight  Dict(str, Tuple(str, list)): Dictionary containing a Name as key and a tuple as values. The tuple
-            is a valid css color at index 0 and a list containing the row indices from deseq_result to highlight
+            is a valid css color at index 0 and a list containing the row indices from deseq_result to highlight.
+            An integer np.ndarray is interpreted as row positions.
         lfc_cutoff: Up and Down regulated genes exceeding this cutoff will be highlighted if they also met the
             adjusted pvalue cutoff.
         padj_cutoff: Up and Down regulated genes exceeding this cutoff will be highlighted if they also met the
@@ -71,22 +106,36 @@ def ma_from_deseq_result(
         base_name (str): General term for genes with a negative log fold change
         highlight_up_color: CSS Color used to highlight up-regulated genes
         highlight_down_color: CSS Color used to highlight down-regulated genes
+        significant (Tuple[np.ndarray, np.ndarray]): Precomputed boolean masks of the up- and down-regulated rows of
+            deseq_result. If given, they are used instead of applying the cutoffs.
+        webgl_threshold (int): If the plot has more points, it is rendered via WebGL and the non highlighted genes
+            are thinned to one point per cell of a density_bins x density_bins grid.
+        density_bins (int): Grid resolution used for thinning.
 
     Returns:
         plotly.graph_objects.Figure:
 
     """
-    df = deseq_result[~pd.isna(deseq_result["baseMean"])]
-    df["log10BaseMean"] = np.log10(df["baseMean"])
+    keep = ~pd.isna(deseq_result["baseMean"]).to_numpy()
+    df = deseq_result[keep]
+    if "log10BaseMean" not in df:
+        df["log10BaseMean"] = np.log10(df["baseMean"])
+    highlight = _position_masks(highlight, keep) if highlight else highlight
     if padj_cutoff is not None:
-        lfc_cutoff = lfc_cutoff if lfc_cutoff else 0
-        upreg = df[(df["padj"] <= padj_cutoff) & (df["log2FoldChange"] > lfc_cutoff)]
-        downreg = df[(df["padj"] <= padj_cutoff) & (df["log2FoldChange"] < -lfc_cutoff)]
+        if significant is None:
+            lfc_cutoff = lfc_cutoff if lfc_cutoff else 0
+            up = (df["padj"] <= padj_cutoff) & (df["log2FoldChange"] > lfc_cutoff)
+            down = (df["padj"] <= padj_cutoff) & (df["log2FoldChange"] < -lfc_cutoff)
+        else:
+            up, down = (mask[keep] for mask in significant)
         condition_name = condition_name if condition_name else "Up"
         base_name = base_name if base_name else "Down"
-        reg = {condition_name: [highlight_up_color, upreg.index.tolist()], base_name: [highlight_down_color, downreg.index.tolist()]}
+        reg = {condition_name: [highlight_up_color, np.asarray(up)], base_name: [highlight_down_color, np.asarray(down)]}
         highlight = (highlight | reg) if highlight else reg
-    fig = _internal_plot_fct(df, x="log10BaseMean", y="log2FoldChange", name_col=name_col, highlight=highlight)
+    fig = _internal_plot_fct(
+        df, x="log10BaseMean", y="log2FoldChange", name_col=name_col, highlight=highlight,
+        webgl_threshold=webgl_threshold, density_bins=density_bins
+    )
 
     fig.update_layout(
         yaxis_title="Log<sub>2</sub>(FoldChange)",
@@ -97,6 +146,18 @@ def ma_from_deseq_result(
 
 
 
+def _position_masks(highlight, keep):
+    # Integer row positions of the deseq result become boolean masks over its plotted rows. Labels are kept as they are
+    masks = {}
+    for key, (color, rows) in highlight.items():
+        if isinstance(rows, np.ndarray) and np.issubdtype(rows.dtype, np.integer):
+            mask = np.zeros(len(keep), dtype=bool)
+            mask[rows] = True
+            rows = mask[keep]
+        masks[key] = (color, rows)
+    return masks
+
+
 def volcano_from_deseq_result(
         deseq_result: pd.DataFrame,
         name_col: str = None,
@@ -107,16 +168,19 @@ def volcano_from_deseq_result(
         base_name: str = None,
         highlight_up_color: str = "#2ca02c",
         highlight_down_color: str = "#002695",
-        opacity: float = 0.05
+        opacity: float = 0.05,
+        webgl_threshold: int = None,
+        density_bins: int = 300,
 ):
     """ Creates a Volcano scatter plot from a deseq result table read as pandas Dataframe.
 
     Args:
         deseq_result (pd.DataFrame): The DESeq2 output read as a pandas dataframe containing at least all columns
-            from a DESeq2 run
+            from a DESeq2 run. A precomputed -log10padj column is used if present.
         name_col (str): Name of the column displayed on point hover
         highlight  Dict(str, Tuple(str, list)): Dictionary containing a Name as key and a tuple as values. The tuple
-            is a valid css color at index 0 and a list containing the row indices from deseq_result to highlight
+            is a valid css color at index 0 and a list containing the row indices from deseq_result to highlight.
+            An integer np.ndarray is interpreted as row positions.
         lfc_cutoff: Cutoff will be displayed by a line or box in the final plot
         padj_cutoff: Cutoff will be displayed by a line or box in the final plot
         condition_name (str): General term for genes with a positiv log fold change
@@ -124,19 +188,31 @@ def volcano_from_deseq_result(
         highlight_up_color: CSS Color used to highlight up-regulated genes box
         highlight_down_color: CSS Color used to highlight down-regulated genes box
         opacity (float): Opacity of the box displaying cutoff settings
+        webgl_threshold (int): If the plot has more points, it is rendered via WebGL and the non highlighted genes
+            outside the cutoff boxes are thinned to one point per cell of a density_bins x density_bins grid.
+        density_bins (int): Grid resolution used for thinning.
 
     Returns:
         plotly.graph_objects.Figure:
 
     """
 
-    df = deseq_result[~pd.isna(deseq_result["padj"])]
-    df["-log10padj"] = -1 * np.log10(df["padj"])
+    keep = ~pd.isna(deseq_result["padj"]).to_numpy()
+    df = deseq_result[keep]
+    if "-log10padj" not in df:
+        df["-log10padj"] = -1 * np.log10(df["padj"])
+    highlight = _position_masks(highlight, keep) if highlight else highlight
     max_log10padj = np.ceil(df["-log10padj"].max())
     min_fc = np.floor(df["log2FoldChange"].min())
     max_fc = np.ceil(df["log2FoldChange"].max())
 
-    fig = _internal_plot_fct(df, name_col=name_col, highlight=highlight)
+    exact = None
+    if lfc_cutoff is not None and padj_cutoff is not None:
+        exact = ((df["padj"] <= padj_cutoff) & (df["log2FoldChange"].abs() >= lfc_cutoff)).to_numpy()
+    fig = _internal_plot_fct(
+        df, name_col=name_col, highlight=highlight, webgl_threshold=webgl_threshold, density_bins=density_bins,
+        exact=exact
+    )
 
     if lfc_cutoff is not None and padj_cutoff is not None:
         fig = _add_boxes(fig, lfc_cutoff, padj_cutoff, highlight_up_color, highlight_down_color, opacity)
@@ -41,51 +41,109 @@ def empty_figure(annotation: str = None):
     return fig
 
 
-def enrichment_plot_from_cp_table(df, mode="scatter", colorscale = None):
-    """ Creates a plotly Figure from a ClusterProfiler Enrichment table
+SYMBOLS = ["circle", "diamond", "square", "x", "cross", "pentagon", "hexagram", "star", "hourglass", "bowtie"]
+
+
+def prepare_enrichment_plot_data(df):
+    """ Converts a ClusterProfiler Enrichment table into the form plotted by enrichment_plot_from_cp_table
+
+    The GeneRatio strings are parsed into a numeric Gene Ratio column. For clustered tables only the most significant
+    term of every ontology and cluster is kept, followed by all unclustered terms. The row order is the plotting order.
+    df is not modified.
 
     Args:
         df (pd.Dataframe): ClusterProfiler Enrichment table in form of a pandas dataframe.
-        mode (str): Either scatter or bar.
-        colorscale (list(str)): List of colors used to generate the colorscale mapping the pvalue
 
     Returns:
-        plotly.graph_objects.Figure:
+        pd.DataFrame: a new DataFrame ready for plotting
 
     """
-    def df_div(l):
-        return int(l[0]) / int(l[1])
-    df["Gene Ratio"] = df["GeneRatio"].str.split("/").apply(df_div)
+    df = df.copy()
+    if len(df):
+        ratio = df["GeneRatio"].str.split("/", expand=True)
+        df["Gene Ratio"] = ratio[0].astype(np.int64) / ratio[1].astype(np.int64)
+    else:
+        df["Gene Ratio"] = pd.Series(dtype=float)
     if "Cluster" in df:
         neg_df = df[df["Cluster"] == -1]
         df = df[df['Cluster'] != -1]
         df = df.sort_values("p.adjust").drop_duplicates(["ONTOLOGY", "Cluster"])
         df = pd.concat([df, neg_df], ignore_index=True)
+    return df
+
+
+def enrichment_plot_from_cp_table(df, mode="scatter", colorscale = None, prepared: bool = False):
+    """ Creates a plotly Figure from a ClusterProfiler Enrichment table
+
+    Args:
+        df (pd.Dataframe): ClusterProfiler Enrichment table in form of a pandas dataframe.
+        mode (str): Either scatter or bar.
+        colorscale (list(str)): List of colors used to generate the colorscale mapping the pvalue
+        prepared (bool): Whether df was already converted via prepare_enrichment_plot_data
+
+    Returns:
+        plotly.graph_objects.Figure:
+
+    """
+    if not prepared:
+        df = prepare_enrichment_plot_data(df)
     if len(df) == 0:
         return empty_figure("Nothing enriched")
+    hovertemplate = "Gene Ratio=%{x}<br>Description=%{y}<br>p.adjust=%{marker.color}<extra></extra>"
+    fig = go.Figure()
     if mode == "scatter":
-        fig = px.scatter(
-            df,
-            x="Gene Ratio",
-            y="Description",
-            symbol="ONTOLOGY" if "ONTOLOGY" in df else None,
-            color="p.adjust",
-            template="plotly_white",
-            color_continuous_scale=colorscale
-
-        )
-        fig.update_traces(marker=dict(size=15))
+        if "ONTOLOGY" in df:
+            ontologies = df["ONTOLOGY"].to_numpy()
+            groups = [(ontology, ontologies == ontology) for ontology in pd.unique(ontologies)]
+        else:
+            groups = [("", np.ones(len(df), dtype=bool))]
+        for idx, (ontology, mask) in enumerate(groups):
+            fig.add_trace(
+                go.Scatter(
+                    x=df["Gene Ratio"].to_numpy()[mask],
+                    y=df["Description"].to_numpy()[mask],
+                    mode="markers",
+                    marker=dict(
+                        color=df["p.adjust"].to_numpy()[mask],
+                        coloraxis="coloraxis",
+                        symbol=SYMBOLS[idx % len(SYMBOLS)],
+                        size=15
+                    ),
+                    name=ontology,
+                    legendgroup=ontology,
+                    showlegend=bool(ontology),
+                    orientation="h",
+                    hovertemplate=f"ONTOLOGY={ontology}<br>{hovertemplate}" if ontology else hovertemplate,
+                )
+            )
+        if "ONTOLOGY" in df:
+            fig.update_layout(legend=dict(title=dict(text="ONTOLOGY")))
 
     elif mode == "bar":
-        fig = px.bar(
-            df,
-            x="Gene Ratio",
-            y="Description",
-            color="p.adjust",
-            template="plotly_white",
+        fig.add_trace(
+            go.Bar(
+                x=df["Gene Ratio"],
+                y=df["Description"],
+                marker=dict(color=df["p.adjust"], coloraxis="coloraxis"),
+                name="",
+                showlegend=False,
+                orientation="h",
+                hovertemplate=hovertemplate,
+            )
         )
+        fig.update_layout(barmode="relative")
     else:
         raise ValueError(f"mode: {mode} is not valid")
+    fig.update_layout(
+        template="plotly_white",
+        xaxis=dict(title=dict(text="Gene Ratio")),
+        yaxis=dict(title=dict(text="Description")),
+        coloraxis=dict(colorbar=dict(title=dict(text="p.adjust"))),
+        legend=dict(tracegroupgap=0),
+        margin=dict(t=60),
+    )
+    if colorscale is not None:
+        fig.update_layout(coloraxis=dict(colorscale=colorscale))
     categories = df["Description"].unique()
     y_range = [-0.75, len(categories)]
 
@@ -108,6 +166,26 @@ def enrichment_plot_from_cp_table(df, mode="scatter", colorscale = None):
     return fig
 
 
+def group_gsea_plot_data(df: pd.DataFrame):
+    """ Sorts GSEA plot data once by Description and x so that the rows of every term are contiguous
+
+    Args:
+        df (pd.Dataframe): ClusterProfiler GSEA plot data in form of a pandas dataframe.
+
+    Returns:
+        Tuple[pd.DataFrame, dict]: The sorted plot data and a Description -> (start, stop) row range lookup that can be
+        passed to plot_gsea as groups.
+
+    """
+    df = df.sort_values(by=["Description", "x"], kind="stable").reset_index(drop=True)
+    if len(df) == 0:
+        return df, {}
+    descs = df["Description"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, descs[1:] != descs[:-1]])
+    stops = np.r_[starts[1:], len(descs)]
+    return df, {descs[start]: (start, stop) for start, stop in zip(starts, stops)}
+
+
 def plot_gsea(
         df: pd.DataFrame,
         info: pd.DataFrame = None,
@@ -116,6 +194,7 @@ def plot_gsea(
         condition_name: str = None,
         base_name: str = None,
         gene_list_name: str = None,
+        groups: dict = None,
         **kwargs
 
 ):
@@ -132,11 +211,23 @@ def plot_gsea(
         condition_name: Summary term for genes that have a positive log fold change.
         base_name: Summary term  for genes that have a negative log fold change.
         gene_list_name (str): How to name the ordering of the GSEA
+        groups (dict): Row ranges per Description as returned by group_gsea_plot_data. If given, df must be the
+            grouped plot data and only the rows of the displayed terms are used.
 
     Returns:
         plotly.graph_objects.Figure:
 
     """
+    if descs is None:
+        descs = df["Description"].unique() if groups is None else list(groups)
+    d = descs
+    if groups is not None:
+        rows = [np.arange(*groups[desc]) for desc in d if desc in groups]
+        df = df.iloc[np.concatenate(rows) if rows else []]
+    else:
+        df = df[df["Description"].isin(d)]
+        df['Description'] = pd.Categorical(df['Description'], categories=d, ordered=True, )
+        df = df.sort_values(by=["Description", "x"])
     if gene_list_name:
         df = df.rename({"geneList": gene_list_name}, axis=1)
     else:
@@ -146,13 +237,6 @@ def plot_gsea(
         hover_data = ["p.adjust", gene_list_name]
     else:
         hover_data = [gene_list_name]
-    if descs is None:
-        descs = df["Description"].unique()
-    d = descs
-    df = df[df["Description"].isin(d)]
-
-    df['Description'] = pd.Categorical(df['Description'], categories=d, ordered=True, )
-    df = df.sort_values(by=["Description", "x"])
     fig_old = px.line(df, x="x", y="runningScore", color='Description', hover_data=hover_data)
     hovertemplate = '<i>Y</i>: %{y:.2f}' + \
                     '<br><b>X</b>: %{x}<br>' + \
@@ -165,7 +249,6 @@ def plot_gsea(
         rows=to_display + 1, shared_xaxes=True,
         **kwargs
     )
-    df[df["position"] == 0]["position"] = np.nan
     check = df[df[gene_list_name] == 0]
     if len(check) > 0:
         pos = check["x"].mean()
@@ -188,7 +271,7 @@ def plot_gsea(
                     marker_color=colors[idx-1],
                     marker_line=dict(width=1, color=colors[idx-1]),
                     name=desc,
-                    hovertext=df["gene"],
+                    hovertext=sdf["gene"],
                     hovertemplate=hovertemplate,
                 ),
                 row=idx + 1, col=1
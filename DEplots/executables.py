@@ -42,6 +42,52 @@ def _dash_parser(subparsers, name):
         help="Number of used cpu cores (Default: 1)",
         default=1
     )
+    parser.add_argument(
+        '--load-workers',
+        type=int,
+        help="Number of threads used to read the run directories on startup (Default: 1)",
+        default=1
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help="Directory used to cache parsed tables between restarts. Overwrites the cache_dir of the config file",
+        default=None
+    )
+    parser.add_argument(
+        '--shared-memory',
+        type=str,
+        nargs="?",
+        const=True,
+        help="Places the numeric DESeq columns in memory mapped files that are shared by all worker processes. "
+             "Optionally takes the directory of these files (Default: /dev/shm/deplots)",
+        default=None
+    )
+    parser.add_argument(
+        '--watch',
+        type=float,
+        help="Polls the runs every WATCH seconds and reloads new, changed or removed runs without a restart",
+        default=None
+    )
+    parser.add_argument(
+        '--compact',
+        action="store_true",
+        help="Stores the DESeq results using float32 and categorical columns where possible to save memory",
+    )
+    parser.add_argument(
+        '--compress',
+        action=argparse.BooleanOptionalAction,
+        help="Compresses the responses of the server using gzip or brotli if it is installed. Overwrites the "
+             "compress of the config file",
+        default=None
+    )
+    parser.add_argument(
+        '--fast-json',
+        action=argparse.BooleanOptionalAction,
+        help="Serializes figures and tables using orjson if it is installed. Overwrites the fast_json of the "
+             "config file",
+        default=None
+    )
     return parser
 
 
@@ -6,6 +6,9 @@ import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 import numpy as np
 import plotly.express as px
+import hashlib
+import threading
+from collections import OrderedDict
 
 available_symbols = [
     # Solid base symbols
@@ -66,6 +69,39 @@ def sample_pca(df, colors = None):
 
 
 
+_DENDROGRAM_CACHE = OrderedDict()
+_DENDROGRAM_CACHE_SIZE = 64
+_DENDROGRAM_LOCK = threading.Lock()
+
+
+def _cluster(matrix):
+    # Linkage and dendrogram only depend on the distance matrix. They are cached by its content, so redrawing the
+    # same heatmap, e.g. after switching the theme, does not cluster again.
+    matrix = np.ascontiguousarray(matrix)
+    key = (matrix.shape, matrix.dtype.str, hashlib.sha1(matrix.tobytes()).hexdigest())
+    with _DENDROGRAM_LOCK:
+        if key in _DENDROGRAM_CACHE:
+            _DENDROGRAM_CACHE.move_to_end(key)
+            return _DENDROGRAM_CACHE[key]
+    condensed_dist = squareform(matrix, checks=False)
+    Z = linkage(condensed_dist, method="complete")
+    ddata = dendrogram(Z, no_plot=True)
+    x_coords = (np.asarray(ddata['icoord']) / 10) - .5
+    y_coords = np.asarray(ddata['dcoord'])
+    # All links as one line with NaN gaps between them
+    gaps = np.full((len(x_coords), 1), np.nan)
+    result = (
+        np.hstack((x_coords, gaps)).ravel(),
+        np.hstack((y_coords, gaps)).ravel(),
+        ddata["leaves"]
+    )
+    with _DENDROGRAM_LOCK:
+        _DENDROGRAM_CACHE[key] = result
+        while len(_DENDROGRAM_CACHE) > _DENDROGRAM_CACHE_SIZE:
+            _DENDROGRAM_CACHE.popitem(last=False)
+    return result
+
+
 def pheatmap(df, colorscale = None, tree_color: str = "black", **kwargs):
     """ Mirrors Rs pheatmap function that produces a clustered heatmap
 
@@ -82,11 +118,7 @@ def pheatmap(df, colorscale = None, tree_color: str = "black", **kwargs):
         matrix = 1 - df.values
     else:
         matrix = df.values
-    condensed_dist = squareform(matrix, checks=False)
-    Z = linkage(condensed_dist, method="complete")
-    ddata = dendrogram(Z, no_plot=True)
-    x_coords = (np.asarray(ddata['icoord']) / 10) - .5
-    y_coords = np.asarray(ddata['dcoord'])
+    x_coords, y_coords, c_order = _cluster(matrix)
     default_args = {
         "row_heights": [0.2, 0.8],
         "column_widths": [0.8, 0.2],
@@ -96,33 +128,31 @@ def pheatmap(df, colorscale = None, tree_color: str = "black", **kwargs):
     }
     kwargs = default_args | kwargs
     fig = make_subplots(rows=2, cols=2, **kwargs)
-    for i in range(len(x_coords)):
-        fig.add_trace(
-            go.Scatter(
-                mode="lines",
-                x=x_coords[i],
-                y=y_coords[i],
-                marker=dict(color=tree_color),
-                line=dict(color=tree_color),
-                showlegend=False
-            ),
-            row=1, col=1
-
-        )
-        fig.add_trace(
-            go.Scatter(
-                mode="lines",
-                x=y_coords[i],
-                y=x_coords[i],
-                marker=dict(color=tree_color),
-                line=dict(color=tree_color),
-                showlegend=False
-
-            ),
-            row=2, col=2
-
-        )
-    c_order = ddata["leaves"]
+    fig.add_trace(
+        go.Scatter(
+            mode="lines",
+            x=x_coords,
+            y=y_coords,
+            marker=dict(color=tree_color),
+            line=dict(color=tree_color),
+            showlegend=False
+        ),
+        row=1, col=1
+
+    )
+    fig.add_trace(
+        go.Scatter(
+            mode="lines",
+            x=y_coords,
+            y=x_coords,
+            marker=dict(color=tree_color),
+            line=dict(color=tree_color),
+            showlegend=False
+
+        ),
+        row=2, col=2
+
+    )
     heatmap_matrix = (df.iloc[c_order, :].iloc[:, c_order]).values
     ticks = df.columns[c_order]
     fig.add_trace(
@@ -144,11 +174,11 @@ def pheatmap(df, colorscale = None, tree_color: str = "black", **kwargs):
         col=2, row=2
     )
     fig.update_yaxes(
-        range=[0, y_coords.max() * 1.05],
+        range=[0, np.nanmax(y_coords) * 1.05],
         row=1
     )
     fig.update_xaxes(
-        range=[0, y_coords.max() * 1.05],
+        range=[0, np.nanmax(y_coords) * 1.05],
         col=2
     )
     return fig
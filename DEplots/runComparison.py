@@ -2,34 +2,57 @@ import pandas as pd
 import plotly.graph_objs as go
 import plotly.express as px
 from DEplots.dashboard import get_data
+from DEplots.dashboard.store import build_store, get_values
+from DEplots.dashboard.significance import SignificanceIndex, count
 from plotly.subplots import make_subplots
 from typing import Tuple, List
 import numpy as np
 import itertools
 
-def compare_two_datasets(df, runs, name_col: Tuple = None, color = px.colors.DEFAULT_PLOTLY_COLORS[0]):
-    names = df.index if not name_col else df.loc[:, name_col]
-    padj1 = df[runs[0], "padj"]
-    padj2 = df[runs[1], "padj"]
-    hovertext = [
-        f"{name}<br>{runs[0]} padj: {p1:.2e}<br>{runs[1]} padj: {p2:.2e}"
-        for name, p1, p2 in zip(names, padj1, padj2)
-    ]
-    fig = go.Figure(
-        go.Scatter(
-            x=df[runs[0], "log2FoldChange"],
-            y=df[runs[1], "log2FoldChange"],
-            mode="markers",
-            marker=dict(color=color),
-            hovertext=hovertext
+def significance_classes(store: dict, runs, padj_cutoff, lfc_cutoff):
+    """ Returns per gene 0 if it is significant in none of the two runs, 1 or 2 if only in the first or second run and 3
+    if in both. Genes are significant if padj <= padj_cutoff and abs(log2FoldChange) >= lfc_cutoff."""
+    significance = store.get("significance", None) or SignificanceIndex(store)
+    bits = significance.get(runs, "up", padj_cutoff, lfc_cutoff) | significance.get(runs, "down", padj_cutoff, -lfc_cutoff)
+    significant = significance.mask(bits)
+    return significant[0].astype(np.int8) + 2 * significant[1].astype(np.int8)
+
+
+def compare_two_datasets(df, runs, name_col: Tuple = None, color = px.colors.DEFAULT_PLOTLY_COLORS[0], store: dict = None, padj_cutoff: float = None, lfc_cutoff: float = None, class_colors = None):
+    store = build_store(df)[1] if store is None else store
+    names = store["genes"].to_numpy() if not name_col else df.loc[:, name_col].to_numpy()
+    lfc = get_values(store, runs, "log2FoldChange")
+    padj = get_values(store, runs, "padj")
+    hovertemplate = f"(%{{x:.2f}}, %{{y:.2f}})<br>%{{text}}<br>{runs[0]} padj: %{{customdata[0]:.2e}}<br>" \
+                    f"{runs[1]} padj: %{{customdata[1]:.2e}}<extra></extra>"
+    fig = go.Figure()
+    if padj_cutoff is None:
+        classes = [("Genes", np.ones(len(names), dtype=bool), color)]
+    else:
+        # One trace per significance class. The traces are always present, so their indices do not change.
+        codes = significance_classes(store, runs, padj_cutoff, lfc_cutoff if lfc_cutoff else 0)
+        class_colors = class_colors if class_colors else (color, ) + tuple(px.colors.DEFAULT_PLOTLY_COLORS[1:4])
+        labels = ["not significant", f"{runs[0]} only", f"{runs[1]} only", "both"]
+        classes = [(label, codes == code, class_colors[code]) for code, label in enumerate(labels)]
+    for label, mask, class_color in classes:
+        fig.add_trace(
+            go.Scatter(
+                x=lfc[mask, 0],
+                y=lfc[mask, 1],
+                mode="markers",
+                marker=dict(color=class_color),
+                name=label,
+                text=names[mask],
+                customdata=padj[mask],
+                hovertemplate=hovertemplate
+            )
         )
-    )
     fig.update_xaxes(title=f"{runs[0]}<br>log<sub>2</sub>(FoldChange)")
     fig.update_yaxes(title=f"{runs[1]}<br>log<sub>2</sub>(FoldChange)")
     return fig
 
 
-def plot_gene_among_conditions(df, genes, name_col: Tuple = None, runs: List = None, colors = px.colors.DEFAULT_PLOTLY_COLORS, **kwargs):
+def plot_gene_among_conditions(df, genes, name_col: Tuple = None, runs: List = None, colors = px.colors.DEFAULT_PLOTLY_COLORS, store: dict = None, **kwargs):
 
     fig = make_subplots(
         rows=len(genes),
@@ -37,29 +60,26 @@ def plot_gene_among_conditions(df, genes, name_col: Tuple = None, runs: List = N
         y_title="log2FoldChange",
         **kwargs
     )
-    idx = pd.IndexSlice
-    names = df.index if not name_col else df.loc[:, name_col]
-    iidx = idx[:, ["log2FoldChange", "lfcSE"]] if runs is None else idx[runs, ["log2FoldChange", "lfcSE"]]
-
-    sdf = df.loc[genes, iidx]
-    columns = sdf.columns.get_level_values(0)[sdf.columns.get_level_values(1) == 'log2FoldChange'].unique()
-    for condition in columns:
-        sdf[(condition, 'log2FoldChange+SE')] = sdf[(condition, 'log2FoldChange')] + sdf[(condition, 'lfcSE')]
-        sdf[(condition, 'log2FoldChange-SE')] = sdf[(condition, 'log2FoldChange')] - sdf[(condition, 'lfcSE')]
-    max_val = np.ceil(sdf.max().max())
-    min_val = np.floor(sdf.min().min())
+    store = build_store(df)[1] if store is None else store
+    runs = store["datasets"] if runs is None else runs
+    positions = store["genes"].get_indexer(genes)
+    lfc = get_values(store, runs, "log2FoldChange")[positions]
+    errors = get_values(store, runs, "lfcSE")[positions]
+    columns = list(runs)
+    values = np.concatenate((lfc, errors, lfc + errors, lfc - errors))
+    max_val = np.ceil(np.nanmax(values))
+    min_val = np.floor(np.nanmin(values))
+    names = df.loc[:, name_col] if name_col else None
     for i, gene in enumerate(genes, 1):
-        slice = sdf.loc[gene, pd.IndexSlice[:, "log2FoldChange"]]
-        errors = sdf.loc[gene, pd.IndexSlice[:, "lfcSE"]]
         name = names.loc[gene] if name_col else gene
         fig.add_trace(
             go.Bar(
                 x=columns,
-                y=slice,
+                y=lfc[i-1],
                 name=name,
                 error_y=dict(
                     type="data",
-                    array=errors,
+                    array=errors[i-1],
                     visible=True,
                 ),
                 showlegend=True,
@@ -74,30 +94,69 @@ def plot_gene_among_conditions(df, genes, name_col: Tuple = None, runs: List = N
     return fig
 
 
-def plotly_upset_plot(df, sorted = False, bar_color="blue", dot_colors=("grey", "black"), trim_zeros: bool = True, show_sum: bool = True,  **kwargs):
-    # an array of dimensions d x d*2^d possible subsets where d is the number of columns
-    subsets = []
-    hovertemplate = "%{hovertext}<extra></extra>"
+def heatmap_gene_among_conditions(df, genes, name_col: Tuple = None, runs: List = None, colorscale = None, store: dict = None):
+    store = build_store(df)[1] if store is None else store
+    runs = store["datasets"] if runs is None else runs
+    positions = store["genes"].get_indexer(genes)
+    lfc = get_values(store, runs, "log2FoldChange")[positions]
+    errors = get_values(store, runs, "lfcSE")[positions]
+    names = df[name_col].to_numpy()[positions] if name_col else np.asarray(genes)
+    # Rows are numbered since gene names do not need to be unique. The name is shown as tick label and on hover.
+    customdata = np.dstack((errors, np.broadcast_to(names[:, None], errors.shape)))
+    fig = go.Figure(
+        go.Heatmap(
+            z=lfc,
+            x=list(runs),
+            y=np.arange(len(genes)),
+            customdata=customdata,
+            zmid=0,
+            colorscale=colorscale,
+            colorbar=dict(title="log2FoldChange"),
+            hovertemplate="%{customdata[1]}<br>%{x}<br>log2FoldChange: %{z:.2f} ± %{customdata[0]:.2f}<extra></extra>",
+        )
+    )
+    fig.update_yaxes(tickvals=np.arange(len(genes)), ticktext=names, autorange="reversed")
+    return fig
+
+
+def _intersection_sizes(packed: np.ndarray, n_sets: int):
+    # Every gene's membership is a packed bit row. np.unique counts each observed row, i.e. each intersection, once.
+    keys, counts = np.unique(packed, axis=0, return_counts=True)
+    members = np.unpackbits(keys, axis=1, count=n_sets).astype(bool)
+    sizes = {}
+    for row, size in zip(members, counts):
+        positions = tuple(np.flatnonzero(row).tolist())
+        if positions:
+            sizes[positions] = int(size)
+    return sizes
+
+
+def plotly_upset_plot(df, sorted = False, bar_color="blue", dot_colors=("grey", "black"), trim_zeros: bool = True, show_sum: bool = True, top_k: int = None, **kwargs):
+    values = df.to_numpy(dtype=bool)
+    sizes = _intersection_sizes(np.packbits(values, axis=1), values.shape[1])
+    return _upset_figure(
+        list(df.columns), sizes, values.sum(axis=0), sorted=sorted, bar_color=bar_color, dot_colors=dot_colors,
+        trim_zeros=trim_zeros, show_sum=show_sum, top_k=top_k, **kwargs
+    )
 
-    # the sizes of each subset (2^d array)
-    subset_sizes = []
-    d = len(df.columns)
-    for i in range(1, d + 1):
-        subsets = subsets + [list(x) for x in list(itertools.combinations(df.columns, i))]
-
-    for s in subsets:
-        curr_bool = [1] * len(df)
-        for col in df.columns:
-            if col in s:
-                curr_bool = [x and y for x, y in zip(curr_bool, list(df.loc[:, col].copy()))]
-            else:
-                curr_bool = [x and not y for x, y in zip(curr_bool, list(df.loc[:, col].copy()))]
-        subset_sizes.append(sum(curr_bool))
+
+def _upset_figure(columns, sizes, set_sizes, sorted = False, bar_color="blue", dot_colors=("grey", "black"), trim_zeros: bool = True, show_sum: bool = True, top_k: int = None, **kwargs):
+    # sizes maps the set positions of every intersection to its size, set_sizes holds the size of every set
+    hovertemplate = "%{hovertext}<extra></extra>"
+    d = len(columns)
+    if trim_zeros:
+        # Only intersections that contain genes, in the same order as enumerating all combinations
+        keys = list(sizes)
+        keys.sort(key=lambda key: (len(key), key))
+    else:
+        keys = [key for i in range(1, d + 1) for key in itertools.combinations(range(d), i)]
+    subsets = [[columns[i] for i in key] for key in keys]
+    subset_sizes = [sizes.get(key, 0) for key in keys]
     plot_df = pd.DataFrame({'Intersection': subsets, 'Size': subset_sizes})
     plot_df["text"] = plot_df["Intersection"].apply(lambda  x: "<br>".join(x))
 
-    if trim_zeros:
-        plot_df = plot_df[plot_df["Size"] != 0]
+    if top_k:
+        plot_df = plot_df.loc[plot_df["Size"].nlargest(top_k, keep="first").index.sort_values()]
     if sorted:
         plot_df = plot_df.sort_values(by='Size', ascending=False)
     if "column_widths" not in kwargs:
@@ -116,8 +175,8 @@ def plotly_upset_plot(df, sorted = False, bar_color="blue", dot_colors=("grey",
         )
     )
 
-    x = np.tile(plot_df["text"], len(df.columns))
-    y = np.repeat(df.columns, len(plot_df["text"]))
+    x = np.tile(plot_df["text"], d)
+    y = np.repeat(columns, len(plot_df["text"]))
 
     fig.add_trace(
         go.Scatter(
@@ -132,31 +191,33 @@ def plotly_upset_plot(df, sorted = False, bar_color="blue", dot_colors=("grey",
         row=2,
         col=1
     )
-    for idx, row in plot_df.iterrows():
-        y = row["Intersection"]
-
+    if len(plot_df):
+        # One trace for all intersections. None entries separate the connector lines of different intersections.
+        lengths = plot_df["Intersection"].str.len().to_numpy() + 1
+        x = np.repeat(plot_df["text"].to_numpy(dtype=object), lengths)
+        x[np.cumsum(lengths) - 1] = None
+        y = [member for members in plot_df["Intersection"] for member in members + [None]]
         fig.add_trace(
             go.Scatter(
-                x=np.repeat(row["text"], len(y)),
+                x=x,
                 y=y,
                 mode="lines+markers",
                 marker=dict(color=dot_colors[1], size=20, line=dict(color=dot_colors[1], width=2)),
                 line=dict(color=dot_colors[1], width=5),
                 showlegend=False,
-                hovertext=np.repeat(row["text"], len(y)),
+                hovertext=x,
                 hovertemplate=hovertemplate,
             ),
             row=2,
             col=1
         )
-    y_range = [-0.5, len(df.columns) - 0.5]
+    y_range = [-0.5, d - 0.5]
     x_range = [-1, len(plot_df["text"])]
     if show_sum:
-        df_sum = df.sum(axis=0)
         fig.add_trace(
             go.Bar(
-                x=df_sum,
-                y=df_sum.keys(),
+                x=set_sizes,
+                y=columns,
                 marker=dict(color=bar_color),
                 name="Set size",
                 orientation="h",
@@ -200,18 +261,14 @@ def plotly_upset_plot(df, sorted = False, bar_color="blue", dot_colors=("grey",
 
 
 
-def upset_plot_from_deseq(df, padj_cutoff, lfc_cutoff, mode: str = "up", **kwargs):
-    columns = df.columns.get_level_values(0)[df.columns.get_level_values(1) == 'log2FoldChange'].unique()
-    data = {}
-    if mode == "up":
-        for condition in columns:
-            data[condition] = (df[(condition, 'log2FoldChange')] >= lfc_cutoff) & (df[(condition, 'padj')] <= padj_cutoff)
-    elif mode == "down":
-        for condition in columns:
-            data[condition] = (df[(condition, 'log2FoldChange')] <= lfc_cutoff) & (df[(condition, 'padj')] <= padj_cutoff)
-
-    data = pd.DataFrame(data)
-    fig = plotly_upset_plot(data, **kwargs)
+def upset_plot_from_deseq(df, padj_cutoff, lfc_cutoff, mode: str = "up", datasets: List = None, **kwargs):
+    store = build_store(df)[1] if isinstance(df, pd.DataFrame) else df
+    significance = store.get("significance", None) or SignificanceIndex(store)
+    datasets = store["datasets"] if datasets is None else datasets
+    bits = significance.get(datasets, mode, padj_cutoff, lfc_cutoff)
+    # The bitsets are packed per dataset, the intersections are counted on the memberships packed per gene
+    members = np.packbits(significance.mask(bits).T, axis=1)
+    fig = _upset_figure(list(datasets), _intersection_sizes(members, len(datasets)), count(bits), **kwargs)
     return fig
 
 
@@ -220,7 +277,7 @@ def upset_plot_from_deseq(df, padj_cutoff, lfc_cutoff, mode: str = "up", **kwarg
 if __name__ == '__main__':
     config_file = "/home/rabsch/PythonProjects/DEPlots/testData/config.yaml"
     rd = "/home/rabsch/PythonProjects/RlocSeq/Pipeline/RUNS/"
-    _, data = get_data(config_file, rd)
+    (_, data, _), _ = get_data(config_file, rd)
     data = data[list(data.keys())[0]]
     genes = data[(data[("Additional Data", "gene_name")].str.contains("psb") == True) & (~data.index.str.contains("UTR"))].index
 